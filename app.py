@@ -1,21 +1,28 @@
-from flask import Flask, render_template, request
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from flask import Flask, render_template, request, jsonify, abort, make_response, Response
 from io import BytesIO
-import base64
+import hashlib
 import requests
 from datetime import datetime, timedelta
 import os
 import json
+import math
 import time
-import random
-import numpy as np 
-from bank_parsers import get_bank_rates
-import pandas as pd
+from bank_parsers import get_bank_rates, refresh_bank_rates, BANK_CURRENCIES
+from scheduler import run_scheduler
+import metrics
+import breakers
+import budget
+import snapshot
+import lru
+from budget import PRIORITY_VIEWED, PRIORITY_BACKFILL
+from metrics import timed
+from charts import render_exchange_chart, render_charts_in_pool
 from collections import defaultdict
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
 
 app = Flask(__name__)
 
@@ -25,14 +32,34 @@ MYSQL_CONFIG = {
     'host': os.getenv('MYSQL_HOST', 'localhost'),
     'database': os.getenv('MYSQL_DATABASE', 'currency_app'),
     'port': os.getenv('MYSQL_PORT', 3306),
-    'ssl_disabled': True
+    'ssl_disabled': True,
+    'connection_timeout': int(os.getenv('MYSQL_CONNECT_TIMEOUT', 3))
 }
 
+MYSQL_POOL_SIZE = int(os.getenv('MYSQL_POOL_SIZE', 5))
+MYSQL_POOL_TIMEOUT = float(os.getenv('MYSQL_POOL_TIMEOUT', 5))
+MYSQL_RETRY_INTERVAL = int(os.getenv('MYSQL_RETRY_INTERVAL', 10))
+INIT_DB_TIMEOUT = int(os.getenv('INIT_DB_TIMEOUT', 600))
+
 ALPHA_VANTAGE_KEY = os.environ.get('ALPHA_VANTAGE_KEY', 'JDAB60C0396F3IRG')
 ALPHA_VANTAGE_URL = 'https://www.alphavantage.co/query'
+ALPHA_VANTAGE_LIMIT_DELAY = int(os.getenv('ALPHA_VANTAGE_LIMIT_DELAY', 60))
 
 API_KEY = os.environ.get('EXCHANGE_API_KEY', '26cdbcfcb33ba430ba05d900')
 BASE_URL = 'https://v6.exchangerate-api.com/v6/'
+REFRESH_MODE = os.getenv('REFRESH_MODE', 'inline')
+SPOT_REFRESH_INTERVAL = int(os.getenv('SPOT_REFRESH_INTERVAL', 900))
+HISTORICAL_REFRESH_INTERVAL = int(os.getenv('HISTORICAL_REFRESH_INTERVAL', 21600))
+HISTORY_QUEUE_INTERVAL = int(os.getenv('HISTORY_QUEUE_INTERVAL', 15))
+BANK_REFRESH_INTERVAL = int(os.getenv('BANK_REFRESH_INTERVAL', 1800))
+REFRESH_LOCK_NAME = 'currency_app_refresh'
+BANK_LOCK_NAME = 'currency_app_bank_refresh'
+BANK_LOCK_TIMEOUT = int(os.getenv('BANK_LOCK_TIMEOUT', 30))
+BANK_DB_TTL = int(os.getenv('BANK_DB_TTL', 3600))
+BANK_RETRY_INTERVAL = int(os.getenv('BANK_RETRY_INTERVAL', 300))
+HISTORY_MAX_DAYS = int(os.getenv('HISTORY_MAX_DAYS', 3650))
+HISTORY_ALIGN_MARGIN = 7
+
 CURRENCIES = ['SGD', 'USD', 'EUR', 'GBP', 'JPY', 'CNY', 'RUB', 'AUD', 'CAD', 'CHF', 'INR']
 
 CURRENCY_NAMES = {
@@ -49,22 +76,125 @@ CURRENCY_NAMES = {
     'INR': 'Индийская рупия'
 }
 
-exchange_rates_cache = {'rates': {}, 'timestamp': 0}
+exchange_rates_cache = {'rates': None, 'timestamp': 0}
+RATES_MEMORY_TTL = int(os.getenv('RATES_MEMORY_TTL', 60))
+RATES_DB_TTL = int(os.getenv('RATES_DB_TTL', 3600))
+rates_refresh_lock = threading.Lock()
 historical_cache = {}
 usd_cross_cache = defaultdict(dict)
 
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', 64))
+chart_cache = lru.new_lru('chart', CHART_CACHE_SIZE)
+CHART_MAX_AGE = int(os.getenv('CHART_MAX_AGE', 3600))
+CHART_DIR = os.getenv('CHART_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chart_cache'))
+CHART_RANGES = {
+    '7d': (7, 'за 7 дней'),
+    '30d': (22, 'за 30 дней'),
+    '1y': (252, 'за год'),
+    '5y': (1260, 'за 5 лет'),
+    'max': (HISTORY_MAX_DAYS, 'за всё время'),
+}
+PAGE_CACHE_SIZE = int(os.getenv('PAGE_CACHE_SIZE', 256))
+page_cache = lru.new_lru('page', PAGE_CACHE_SIZE)
+BANK_MEMORY_TTL = int(os.getenv('BANK_MEMORY_TTL', 60))
+bank_rates_memory = {}
+PAGE_FANOUT = os.getenv('PAGE_FANOUT', '1') == '1'
+PAGE_WORKERS = int(os.getenv('PAGE_WORKERS', 8))
+PAGE_BANKS_DEADLINE = float(os.getenv('PAGE_BANKS_DEADLINE', 3))
+page_executor = {'executor': None, 'pid': None}
+page_executor_lock = threading.Lock()
+bank_lookups = {}
+bank_lookups_lock = threading.Lock()
+prerender_stats = {'rendered': 0, 'failed': 0, 'skipped': 0, 'seconds': 0.0, 'finished_at': None}
+
+mysql_pool = {'pool': None, 'pid': None, 'failed_at': 0}
+mysql_pool_lock = threading.Lock()
+mysql_pool_stats = {
+    'checkouts': 0,
+    'timeouts': 0,
+    'errors': 0,
+    'wait_time_total': 0.0,
+    'wait_time_max': 0.0
+}
+# Счётчики обновляют потоки запросов одновременно; отдельная блокировка,
+# чтобы не ждать создания пула под mysql_pool_lock
+mysql_pool_stats_lock = threading.Lock()
+
+def get_connection_pool():
+    # Пул создаётся заново в каждом процессе: соединения, открытые до fork
+    # в мастере gunicorn, нельзя делить между воркерами.
+    pid = os.getpid()
+    with mysql_pool_lock:
+        if mysql_pool['pool'] is None or mysql_pool['pid'] != pid:
+            # Пока MySQL недоступен, не ждём таймаут подключения на каждом запросе.
+            if time.time() - mysql_pool['failed_at'] < MYSQL_RETRY_INTERVAL:
+                raise Error("MySQL недоступен, повтор подключения позже")
+            try:
+                mysql_pool['pool'] = pooling.MySQLConnectionPool(
+                    pool_name=f'currency_app_{pid}',
+                    pool_size=MYSQL_POOL_SIZE,
+                    pool_reset_session=True,
+                    **MYSQL_CONFIG
+                )
+            except Error:
+                mysql_pool['failed_at'] = time.time()
+                raise
+            mysql_pool['pid'] = pid
+        return mysql_pool['pool']
+
 def create_connection():
     try:
-        connection = mysql.connector.connect(**MYSQL_CONFIG)
-        return connection
+        pool = get_connection_pool()
     except Error as e:
+        count_pool_event('errors')
         print(f"Ошибка подключения к MySQL: {e}")
         return None
 
+    # get_connection() сам проверяет соединение и переподключается,
+    # если оно устарело; ждём только когда все соединения заняты.
+    started = time.monotonic()
+    while True:
+        try:
+            connection = pool.get_connection()
+            break
+        except PoolError:
+            if time.monotonic() - started >= MYSQL_POOL_TIMEOUT:
+                count_pool_event('timeouts')
+                print("Ошибка подключения к MySQL: пул соединений исчерпан")
+                return None
+            time.sleep(0.01)
+        except Error as e:
+            count_pool_event('errors')
+            print(f"Ошибка подключения к MySQL: {e}")
+            return None
+
+    waited = time.monotonic() - started
+    with mysql_pool_stats_lock:
+        mysql_pool_stats['checkouts'] += 1
+        mysql_pool_stats['wait_time_total'] += waited
+        mysql_pool_stats['wait_time_max'] = max(mysql_pool_stats['wait_time_max'], waited)
+    return connection
+
+def count_pool_event(name):
+    with mysql_pool_stats_lock:
+        mysql_pool_stats[name] += 1
+
+def release_connection(connection):
+    try:
+        connection.close()
+    except Error as e:
+        print(f"Ошибка возврата соединения в пул: {e}")
+
+def get_mysql_pool_stats():
+    with mysql_pool_stats_lock:
+        stats = dict(mysql_pool_stats)
+    stats['pool_size'] = MYSQL_POOL_SIZE
+    return stats
+
 def init_database():
     connection = create_connection()
     if connection is None:
-        return
+        return False
     
     try:
         cursor = connection.cursor()
@@ -103,17 +233,45 @@ def init_database():
             UNIQUE KEY (bank_name, currency)
         )
         """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS api_budget (
+            name VARCHAR(32) PRIMARY KEY,
+            tokens DOUBLE NOT NULL,
+            updated DOUBLE NOT NULL,
+            day VARCHAR(10) NOT NULL,
+            day_used INT NOT NULL
+        )
+        """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS historical_requests (
+            currency VARCHAR(3) PRIMARY KEY,
+            priority INT NOT NULL,
+            requested DOUBLE NOT NULL
+        )
+        """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS refresh_attempts (
+            name VARCHAR(64) PRIMARY KEY,
+            attempted DOUBLE NOT NULL
+        )
+        """)
         
         connection.commit()
         print("Таблицы успешно созданы")
+        return True
         
     except Error as e:
         print(f"Ошибка при создании таблиц: {e}")
+        return False
     finally:
         if connection.is_connected():
             cursor.close()
-            connection.close()
+        release_connection(connection)
 
+@timed('mysql_save_exchange_rates')
 def save_exchange_rates_to_db(rates):
     connection = create_connection()
     if connection is None:
@@ -121,14 +279,18 @@ def save_exchange_rates_to_db(rates):
     
     try:
         cursor = connection.cursor()
-        cursor.execute("DELETE FROM exchange_rates")
-
-        for from_curr, to_currencies in rates.items():
-            for to_curr, rate in to_currencies.items():
-                cursor.execute("""
-                INSERT INTO exchange_rates (from_currency, to_currency, rate)
-                VALUES (%s, %s, %s)
-                """, (from_curr, to_curr, rate))
+        cursor.execute("DELETE FROM exchange_rates WHERE from_currency <> 'USD'")
+        rows = [
+            ('USD', currency, float(rate))
+            for currency, rate in zip(rates['currencies'], rates['usd_rates'])
+        ]
+        cursor.executemany("""
+        INSERT INTO exchange_rates (from_currency, to_currency, rate)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            rate = VALUES(rate),
+            timestamp = CURRENT_TIMESTAMP
+        """, rows)
         
         connection.commit()
         print("Курсы валют сохранены в БД")
@@ -138,8 +300,9 @@ def save_exchange_rates_to_db(rates):
     finally:
         if connection.is_connected():
             cursor.close()
-            connection.close()
+        release_connection(connection)
 
+@timed('mysql_get_exchange_rates')
 def get_exchange_rates_from_db():
     connection = create_connection()
     if connection is None:
@@ -147,19 +310,21 @@ def get_exchange_rates_from_db():
     
     try:
         cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT from_currency, to_currency, rate FROM exchange_rates")
+        cursor.execute("""
+        SELECT to_currency, rate, TIMESTAMPDIFF(SECOND, timestamp, NOW()) AS age
+        FROM exchange_rates
+        WHERE from_currency = 'USD'
+        """)
         rows = cursor.fetchall()
         
         if not rows:
             return None
         
-        rates = {}
-        for row in rows:
-            if row['from_currency'] not in rates:
-                rates[row['from_currency']] = {}
-            rates[row['from_currency']][row['to_currency']] = row['rate']
-        
-        return rates
+        age = max(row['age'] for row in rows)
+        return make_rate_vector(
+            {row['to_currency']: row['rate'] for row in rows},
+            timestamp=time.time() - age
+        )
         
     except Error as e:
         print(f"Ошибка получения курсов из БД: {e}")
@@ -167,8 +332,9 @@ def get_exchange_rates_from_db():
     finally:
         if connection.is_connected():
             cursor.close()
-            connection.close()
+        release_connection(connection)
 
+@timed('mysql_save_historical_rates')
 def save_historical_rates_to_db(from_curr, to_curr, rates, dates):
     connection = create_connection()
     if connection is None:
@@ -176,18 +342,19 @@ def save_historical_rates_to_db(from_curr, to_curr, rates, dates):
     
     try:
         cursor = connection.cursor()
-        cursor.execute("""
-        DELETE FROM historical_rates 
-        WHERE from_currency = %s AND to_currency = %s
-        """, (from_curr, to_curr))
-
-        for date, rate in zip(dates, rates):
-            cursor.execute("""
-            INSERT INTO historical_rates (from_currency, to_currency, date, rate)
-            VALUES (%s, %s, %s, %s)
-            """, (from_curr, to_curr, date, rate))
+        rows = [(from_curr, to_curr, date, rate) for date, rate in zip(dates, rates)]
+        if not rows:
+            return
+        cursor.executemany("""
+        INSERT INTO historical_rates (from_currency, to_currency, date, rate)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            rate = VALUES(rate),
+            timestamp = CURRENT_TIMESTAMP
+        """, rows)
         
         connection.commit()
+        invalidate_chart_cache(to_curr if from_curr == 'USD' else from_curr)
         print(f"Исторические данные для {from_curr}/{to_curr} сохранены в БД")
         
     except Error as e:
@@ -195,8 +362,9 @@ def save_historical_rates_to_db(from_curr, to_curr, rates, dates):
     finally:
         if connection.is_connected():
             cursor.close()
-            connection.close()
+        release_connection(connection)
 
+@timed('mysql_get_historical_rates')
 def get_historical_rates_from_db(from_curr, to_curr, days=7):
     connection = create_connection()
     if connection is None:
@@ -231,8 +399,32 @@ def get_historical_rates_from_db(from_curr, to_curr, days=7):
     finally:
         if connection.is_connected():
             cursor.close()
-            connection.close()
+        release_connection(connection)
+
+@timed('mysql_get_latest_historical_date')
+def get_latest_historical_date(from_curr, to_curr):
+    connection = create_connection()
+    if connection is None:
+        return None
+    
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        SELECT MAX(date)
+        FROM historical_rates
+        WHERE from_currency = %s AND to_currency = %s
+        """, (from_curr, to_curr))
+        return cursor.fetchone()[0]
+        
+    except Error as e:
+        print(f"Ошибка получения последней даты из БД: {e}")
+        return None
+    finally:
+        if connection.is_connected():
+            cursor.close()
+        release_connection(connection)
 
+@timed('mysql_save_bank_rates')
 def save_bank_rates_to_db(bank_rates):
     connection = create_connection()
     if connection is None:
@@ -240,22 +432,24 @@ def save_bank_rates_to_db(bank_rates):
     
     try:
         cursor = connection.cursor()
-        
-        for bank in bank_rates:
-            cursor.execute("""
-            INSERT INTO bank_rates (bank_name, currency, buy_rate, sell_rate, updated)
-            VALUES (%s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE 
-                buy_rate = VALUES(buy_rate),
-                sell_rate = VALUES(sell_rate),
-                updated = VALUES(updated)
-            """, (
-                bank['name'], 
-                bank['currency'], 
-                bank['buy'], 
-                bank['sell'], 
-                bank['updated']
-            ))
+        # Устаревшие и пустые записи не пишем, иначе они обновят timestamp
+        # и будут считаться свежими.
+        rows = [
+            (bank['name'], bank['currency'], bank['buy'], bank['sell'])
+            for bank in bank_rates
+            if bank['buy'] and not bank.get('stale')
+        ]
+        if not rows:
+            return
+        cursor.executemany("""
+        INSERT INTO bank_rates (bank_name, currency, buy_rate, sell_rate, updated)
+        VALUES (%s, %s, %s, %s, NOW())
+        ON DUPLICATE KEY UPDATE 
+            buy_rate = VALUES(buy_rate),
+            sell_rate = VALUES(sell_rate),
+            updated = VALUES(updated),
+            timestamp = CURRENT_TIMESTAMP
+        """, rows)
         
         connection.commit()
         print("Банковские курсы сохранены в БД")
@@ -265,8 +459,9 @@ def save_bank_rates_to_db(bank_rates):
     finally:
         if connection.is_connected():
             cursor.close()
-            connection.close()
+        release_connection(connection)
 
+@timed('mysql_get_bank_rates')
 def get_bank_rates_from_db(currency):
     connection = create_connection()
     if connection is None:
@@ -279,8 +474,8 @@ def get_bank_rates_from_db(currency):
         SELECT bank_name, currency, buy_rate, sell_rate, updated 
         FROM bank_rates 
         WHERE currency = %s 
-          AND timestamp >= NOW() - INTERVAL 1 HOUR
-        """, (currency,))
+          AND timestamp >= NOW() - INTERVAL %s SECOND
+        """, (currency, BANK_DB_TTL))
         
         rows = cursor.fetchall()
         
@@ -305,48 +500,327 @@ def get_bank_rates_from_db(currency):
     finally:
         if connection.is_connected():
             cursor.close()
-            connection.close()
-
-init_database()
+        release_connection(connection)
 
-def fetch_exchange_rates():
-    db_rates = get_exchange_rates_from_db()
-    if db_rates:
-        print("Используются курсы из БД")
-        exchange_rates_cache['rates'] = db_rates
-        exchange_rates_cache['timestamp'] = time.time()
-        return db_rates
+def refresh_shared_bank_rates(force=False):
+    # Банки парсит только один процесс: остальные ждут блокировку
+    # и затем читают уже сохранённые им курсы. Блокировка берётся на
+    # отдельном соединении вне пула: ожидающие не должны занимать
+    # соединения, которые нужны владельцу блокировки для проверки и записи.
+    if time.time() - mysql_pool['failed_at'] < MYSQL_RETRY_INTERVAL:
+        return False
+    try:
+        connection = mysql.connector.connect(**MYSQL_CONFIG)
+    except Error as e:
+        print(f"Ошибка обновления банковских курсов: {e}")
+        return False
     
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (BANK_LOCK_NAME, BANK_LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            return False
+
+        try:
+            if not force:
+                if all(get_bank_rates_from_db(c) for c in BANK_CURRENCIES):
+                    return True
+                # Владелец блокировки недавно парсил банки, но курсов не получил:
+                # ожидающие не повторяют ту же неудачную попытку. Пауза не
+                # длиннее BANK_DB_TTL, иначе задержала бы и обычное обновление.
+                attempted = get_refresh_attempt(connection, BANK_LOCK_NAME)
+                retry_interval = min(BANK_RETRY_INTERVAL, BANK_DB_TTL)
+                if attempted is not None and time.time() - attempted < retry_interval:
+                    return False
+            save_refresh_attempt(connection, BANK_LOCK_NAME)
+            results = refresh_bank_rates(BANK_CURRENCIES)
+            save_bank_rates_to_db([bank for banks in results.values() for bank in banks])
+            snapshot.update_snapshot(banks={
+                currency: banks for currency, banks in results.items()
+                if any(bank['buy'] for bank in banks)
+            })
+            for currency in results:
+                bank_rates_memory.pop(currency, None)
+                invalidate_page_cache(currency)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (BANK_LOCK_NAME,))
+            cursor.fetchone()
+        return True
+        
+    except Error as e:
+        print(f"Ошибка обновления банковских курсов: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            cursor.close()
+        connection.close()
+
+def get_refresh_attempt(connection, name):
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT attempted FROM refresh_attempts WHERE name = %s", (name,))
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+    except Error as e:
+        print(f"Ошибка чтения времени обновления {name}: {e}")
+        return None
+
+def save_refresh_attempt(connection, name):
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        INSERT INTO refresh_attempts (name, attempted) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE attempted = VALUES(attempted)
+        """, (name, time.time()))
+        connection.commit()
+        cursor.close()
+    except Error as e:
+        print(f"Ошибка записи времени обновления {name}: {e}")
+
+api_budget_memory = {}
+history_queue_memory = {}
+budget_lock = threading.Lock()
+
+def acquire_api_budget(name='alpha_vantage'):
+    # Бюджет хранится в БД, чтобы его делили все воркеры и он переживал
+    # перезапуск; без БД считаем его в памяти процесса.
+    now = time.time()
+    connection = create_connection()
+    if connection is None:
+        with budget_lock:
+            bucket = api_budget_memory.setdefault(name, budget.new_bucket(now))
+            return budget.take_token(bucket, now)
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        initial = budget.new_bucket(now)
+        cursor.execute("""
+        INSERT IGNORE INTO api_budget (name, tokens, updated, day, day_used)
+        VALUES (%s, %s, %s, %s, %s)
+        """, (name, initial['tokens'], initial['updated'], initial['day'], initial['day_used']))
+        cursor.execute("""
+        SELECT tokens, updated, day, day_used
+        FROM api_budget
+        WHERE name = %s
+        FOR UPDATE
+        """, (name,))
+        bucket = cursor.fetchone()
+        allowed = budget.take_token(bucket, now)
+        cursor.execute("""
+        UPDATE api_budget
+        SET tokens = %s, updated = %s, day = %s, day_used = %s
+        WHERE name = %s
+        """, (bucket['tokens'], bucket['updated'], bucket['day'], bucket['day_used'], name))
+        connection.commit()
+        return allowed
+        
+    except Error as e:
+        print(f"Ошибка учёта лимита {name}: {e}")
+        return False
+    finally:
+        if connection.is_connected():
+            cursor.close()
+        release_connection(connection)
+
+def enqueue_historical_fetch(currency, priority=PRIORITY_BACKFILL):
+    connection = create_connection()
+    if connection is None:
+        with budget_lock:
+            budget.enqueue(history_queue_memory, currency, priority, time.time())
+        return
+
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+        INSERT INTO historical_requests (currency, priority, requested)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE priority = LEAST(priority, VALUES(priority))
+        """, (currency, priority, time.time()))
+        connection.commit()
+        
+    except Error as e:
+        print(f"Ошибка постановки в очередь USD/{currency}: {e}")
+    finally:
+        if connection.is_connected():
+            cursor.close()
+        release_connection(connection)
+
+def claim_historical_fetch():
+    # Запись удаляется при взятии, поэтому одну валюту не заберут два воркера
+    connection = create_connection()
+    if connection is None:
+        with budget_lock:
+            return budget.pop_next(history_queue_memory)
+
+    try:
+        cursor = connection.cursor()
+        for _ in range(3):
+            cursor.execute("""
+            SELECT currency, priority
+            FROM historical_requests
+            ORDER BY priority, requested
+            LIMIT 1
+            """)
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute("DELETE FROM historical_requests WHERE currency = %s", (row[0],))
+            connection.commit()
+            if cursor.rowcount == 1:
+                return row[0], row[1]
+        return None
+        
+    except Error as e:
+        print(f"Ошибка чтения очереди исторических данных: {e}")
+        return None
+    finally:
+        if connection.is_connected():
+            cursor.close()
+        release_connection(connection)
+
+@app.cli.command('init-db')
+def init_db_command():
+    # MySQL при старте контейнера может подняться позже приложения:
+    # повторяем до срока, затем выходим с ненулевым кодом. start.sh
+    # запускает команду в фоне и не ждёт её, поэтому сервер стартует сразу.
+    deadline = time.monotonic() + INIT_DB_TIMEOUT
+    while not init_database():
+        if time.monotonic() >= deadline:
+            raise SystemExit(f"Не удалось создать таблицы за {INIT_DB_TIMEOUT} с")
+        time.sleep(MYSQL_RETRY_INTERVAL)
+
+@app.cli.command('prerender-charts')
+def prerender_charts_command():
+    prerender_charts()
+
+def make_rate_vector(usd_rates, timestamp=None):
+    import numpy as np
+
+    currencies = list(usd_rates)
+    return {
+        'currencies': currencies,
+        'index': {currency: i for i, currency in enumerate(currencies)},
+        'usd_rates': np.array([usd_rates[c] for c in currencies], dtype=np.float64),
+        'timestamp': time.time() if timestamp is None else timestamp
+    }
+
+def cross_rate(rates, from_curr, to_curr, default=1.0):
+    if not rates:
+        return default
+    index = rates['index']
+    if from_curr not in index or to_curr not in index:
+        return default
+    usd_rates = rates['usd_rates']
+    return float(usd_rates[index[to_curr]] / usd_rates[index[from_curr]])
+
+def convert_batch(rates, amounts, from_codes, to_codes):
+    import numpy as np
+    import pandas as pd
+
+    currencies = pd.Index(rates['currencies'])
+    from_idx = currencies.get_indexer(from_codes)
+    to_idx = currencies.get_indexer(to_codes)
+    valid = (from_idx >= 0) & (to_idx >= 0)
+
+    usd_rates = rates['usd_rates']
+    pair_rates = np.where(valid, usd_rates[to_idx] / usd_rates[from_idx], np.nan)
+    return pair_rates, np.round(amounts * pair_rates, 2)
+
+@timed('upstream_exchangerate_api')
+def fetch_exchange_rates_from_api():
+    if not breakers.allow('exchangerate_api'):
+        return None
+
     print("Получение курсов из API")
     try:
-        response = requests.get(f'{BASE_URL}{API_KEY}/latest/USD')
+        response = requests.get(f'{BASE_URL}{API_KEY}/latest/USD', timeout=breakers.UPSTREAM_TIMEOUT)
         data = response.json()
         
         if data['result'] == 'success':
-            rates = data['conversion_rates']
-            all_rates = {}
-            for from_curr in CURRENCIES:
-                all_rates[from_curr] = {}
-                for to_curr in CURRENCIES:
-                    if from_curr == to_curr:
-                        all_rates[from_curr][to_curr] = 1.0
-                    elif from_curr == 'USD':
-                        all_rates[from_curr][to_curr] = rates.get(to_curr, 1.0)
-                    else:
-                        usd_to_target = rates.get(to_curr, 1.0)
-                        usd_to_base = rates.get(from_curr, 1.0)
-                        all_rates[from_curr][to_curr] = usd_to_target / usd_to_base
-
-            exchange_rates_cache['rates'] = all_rates
-            exchange_rates_cache['timestamp'] = time.time()
-            save_exchange_rates_to_db(all_rates)
-            return all_rates
+            breakers.record_success('exchangerate_api')
+            return make_rate_vector(data['conversion_rates'])
+        breakers.record_failure('exchangerate_api', data.get('error-type', 'Unknown error'))
     except Exception as e:
         print(f"Ошибка при получении курсов: {e}")
+        breakers.record_failure('exchangerate_api', e)
+
+    return None
+
+def refresh_exchange_rates():
+    # Снимок на диске общий для всех воркеров и читается без обращения к БД
+    snapshot_rates = snapshot.read_rates()
+    if snapshot_rates and time.time() - snapshot_rates['timestamp'] < RATES_DB_TTL:
+        metrics.count_cache('rates_snapshot', 'hit')
+        rates = snapshot_rates
+    else:
+        metrics.count_cache('rates_snapshot', 'miss')
+        rates = refresh_exchange_rates_from_db()
+        if not rates:
+            rates = exchange_rates_cache['rates'] or snapshot_rates
+
+    if rates:
+        exchange_rates_cache['rates'] = rates
+        exchange_rates_cache['timestamp'] = time.time()
+    return rates
+
+def refresh_exchange_rates_from_db():
+    db_rates = get_exchange_rates_from_db()
+    if db_rates and time.time() - db_rates['timestamp'] < RATES_DB_TTL:
+        metrics.count_cache('rates_db', 'hit')
+        print("Используются курсы из БД")
+        snapshot.update_snapshot(rates=db_rates)
+        return db_rates
+
+    if REFRESH_MODE == 'inline':
+        metrics.count_cache('rates_db', 'miss')
+        rates = fetch_exchange_rates_from_api()
+        if rates:
+            save_exchange_rates_to_db(rates)
+            snapshot.update_snapshot(rates=rates)
+            return rates
+    return db_rates
+
+def refresh_exchange_rates_in_background():
+    if not rates_refresh_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            refresh_exchange_rates()
+        finally:
+            rates_refresh_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+@timed('rates_lookup')
+def fetch_exchange_rates():
+    rates = exchange_rates_cache['rates']
+    if rates:
+        if time.time() - exchange_rates_cache['timestamp'] >= RATES_MEMORY_TTL:
+            metrics.count_cache('rates_memory', 'stale')
+            refresh_exchange_rates_in_background()
+        else:
+            metrics.count_cache('rates_memory', 'hit')
+        return rates
+
+    metrics.count_cache('rates_memory', 'miss')
+    with rates_refresh_lock:
+        if exchange_rates_cache['rates']:
+            return exchange_rates_cache['rates']
+        return refresh_exchange_rates()
 
-    return exchange_rates_cache['rates']
+def alpha_vantage_pair_breaker(from_curr, to_curr):
+    return f'alpha_vantage_{from_curr}_{to_curr}'
+
+@timed('upstream_alpha_vantage')
+def fetch_direct_historical_range(from_curr, to_curr, days=7, since=None):
+    # Ошибка по конкретной паре (неизвестный символ) кэшируется отдельно,
+    # чтобы не отключать весь Alpha Vantage из-за одной валюты.
+    pair_breaker = alpha_vantage_pair_breaker(from_curr, to_curr)
+    if not breakers.allow(pair_breaker) or not breakers.allow('alpha_vantage'):
+        return None, None
 
-def fetch_direct_historical_range(from_curr, to_curr, days=7):
     try:
         params = {
             'function': 'FX_DAILY',
@@ -357,16 +831,24 @@ def fetch_direct_historical_range(from_curr, to_curr, days=7):
             'datatype': 'json'
         }
         
-        response = requests.get(ALPHA_VANTAGE_URL, params=params)
+        response = requests.get(ALPHA_VANTAGE_URL, params=params, timeout=breakers.UPSTREAM_TIMEOUT)
         data = response.json()
         
         if 'Note' in data:
             print(f"API Limit: {data['Note']}")
+            breakers.record_failure('alpha_vantage', 'rate limit', delay=ALPHA_VANTAGE_LIMIT_DELAY)
             return None, None
             
         if 'Time Series FX (Daily)' in data:
+            breakers.record_success('alpha_vantage')
+            breakers.record_success(pair_breaker)
             series = data['Time Series FX (Daily)']
-            sorted_dates = sorted(series.keys(), reverse=True)[:days]
+            sorted_dates = sorted(series.keys(), reverse=True)
+            if since is not None:
+                # Последний сохранённый день запрашиваем повторно, чтобы
+                # перезаписать его окончательным значением
+                sorted_dates = [d for d in sorted_dates if d >= since.isoformat()]
+            sorted_dates = sorted_dates[:days]
             
             dates = []
             rates = []
@@ -378,116 +860,437 @@ def fetch_direct_historical_range(from_curr, to_curr, days=7):
                 
             return rates, dates
 
-        print(f"API Error: {data.get('Information', 'Unknown error')}")
+        if 'Information' in data:
+            # Так Alpha Vantage сообщает о суточном лимите
+            print(f"API Error: {data['Information']}")
+            breakers.record_failure('alpha_vantage', data['Information'], delay=ALPHA_VANTAGE_LIMIT_DELAY)
+        elif 'Error Message' in data:
+            print(f"API Error: {data['Error Message']}")
+            breakers.record_failure(pair_breaker, data['Error Message'], delay=breakers.BREAKER_MAX_DELAY)
+        else:
+            print("API Error: Unknown error")
+            breakers.record_failure('alpha_vantage', 'Unknown error')
         return None, None
         
     except Exception as e:
         print(f"Direct historical error {from_curr}/{to_curr}: {e}")
+        breakers.record_failure('alpha_vantage', e)
         return None, None
 
-def fetch_historical_range(from_curr, to_curr, days=7):
-    db_rates, db_dates = get_historical_rates_from_db(from_curr, to_curr, days)
-    if db_rates and db_dates:
-        print(f"Используются исторические данные из БД для {from_curr}/{to_curr}")
-        return db_rates, db_dates
-    
-    print(f"Получение исторических данных из API для {from_curr}/{to_curr}")
-    rates, dates = fetch_direct_historical_range(from_curr, to_curr, days)
+def cross_historical_series(from_leg, to_leg, days=7):
+    import numpy as np
 
-    if rates is None and from_curr != 'USD' and to_curr != 'USD':
-        usd_rates1, usd_dates1 = fetch_historical_range(from_curr, 'USD', days)
-        usd_rates2, usd_dates2 = fetch_historical_range(to_curr, 'USD', days)
-        
-        if usd_rates1 and usd_rates2:
-            dict1 = dict(zip(usd_dates1, usd_rates1))
-            dict2 = dict(zip(usd_dates2, usd_rates2))
-            common_dates = sorted(set(usd_dates1) & set(usd_dates2), reverse=True)[:days]
-            
-            if common_dates:
-                rates = []
-                dates = common_dates
-                for date in common_dates:
-                    cross_rate = dict1[date] / dict2[date]
-                    rates.append(cross_rate)
-
-    if rates is not None:
-        save_historical_rates_to_db(from_curr, to_curr, rates, dates)
-        return rates, dates
-    
-    return None, None
+    # Ноги — ряды USD->валюта (новые даты первыми); None означает сам USD.
+    if from_leg is None:
+        rates, dates = to_leg
+        return list(rates[:days]), list(dates[:days])
 
-def generate_exchange_chart(from_curr, to_curr):
-    rates, dates = fetch_historical_range(from_curr, to_curr, days=7)
-    
-    if rates and dates:
-        chart_title = f'Динамика курса {from_curr}/{to_curr} за 7 дней'
+    from_rates, from_dates = from_leg
+    if to_leg is None:
+        rates = 1.0 / np.asarray(from_rates[:days], dtype=np.float64)
+        return rates.tolist(), list(from_dates[:days])
+
+    to_rates, to_dates = to_leg
+    common_dates, from_idx, to_idx = np.intersect1d(
+        np.array(from_dates, dtype='datetime64[D]'),
+        np.array(to_dates, dtype='datetime64[D]'),
+        return_indices=True
+    )
+    rates = (np.asarray(to_rates, dtype=np.float64)[to_idx] /
+             np.asarray(from_rates, dtype=np.float64)[from_idx])
+
+    newest = slice(None, -days - 1, -1)
+    return rates[newest].tolist(), common_dates[newest].astype(object).tolist()
+
+def previous_business_day(today=None):
+    day = (today or datetime.now().date()) - timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+def fetch_usd_leg_from_upstream(currency):
+    latest = get_latest_historical_date('USD', currency)
+    if latest is not None and latest >= previous_business_day():
+        return [], []
+
+    if latest is None:
+        days = HISTORY_MAX_DAYS
     else:
-        base_rate = exchange_rates_cache['rates'].get(from_curr, {}).get(to_curr, 1.0)
-        dates = [datetime.now().date() - timedelta(days=i) for i in range(6, -1, -1)]
-        rates = [base_rate * (1 + random.uniform(-0.02, 0.02)) for _ in range(7)]
-
-        for i in range(1, 7):
-            volatility = 0.015 if 'JPY' in (from_curr, to_curr) else 0.008
-            change = random.uniform(-volatility, volatility)
-            rates[i] = rates[i-1] * (1 + change)
-
-        rates[-1] = base_rate
-        chart_title = f'Динамика курса {from_curr}/{to_curr}'
-
-    plt.figure(figsize=(10, 6))
-    plt.plot(dates, rates, marker='o', linestyle='-', color='#1F2261', 
-             markersize=6, linewidth=2.5, markerfacecolor='white', markeredgewidth=1.5)
-    plt.fill_between(dates, rates, min(rates)*0.99, color='#1F2261', alpha=0.1)
-
-    if len(rates) > 1:
-        x_dates = matplotlib.dates.date2num(dates)
-        z = np.polyfit(x_dates, rates, 1)
-        p = np.poly1d(z)
-        plt.plot(dates, p(x_dates), 'r--', linewidth=1.5, alpha=0.7)
-    
-    plt.title(chart_title, fontsize=14, pad=20)
-    plt.xlabel('Дата', fontsize=12)
-    plt.ylabel(f'Курс {from_curr} к {to_curr}', fontsize=12)
-    plt.grid(True, linestyle='--', alpha=0.7)
-
-    date_labels = [date.strftime('%d-%m') for date in dates]
-    plt.xticks(dates, date_labels, rotation=15)
-
-    if rates[0] != 0:
-        change_percent = ((rates[-1] - rates[0]) / rates[0]) * 100
-        change_text = f"Изменение: {change_percent:+.2f}%"
-        change_color = 'green' if change_percent >= 0 else 'red'
-        plt.annotate(change_text, xy=(0.95, 0.95), xycoords='axes fraction',
-                    color=change_color, fontsize=12,
-                    bbox=dict(boxstyle='round,pad=0.3', fc='white', ec=change_color, alpha=0.8))
-
-    for i, (date, rate) in enumerate(zip(dates, rates)):
-        if i == 0 or i == len(rates)-1 or i % 2 == 0:
-            fmt = '.2f' if to_curr == 'RUB' or from_curr == 'RUB' else '.4f'
-            plt.annotate(f'{rate:{fmt}}', 
-                         xy=(date, rate),
-                         xytext=(0, 10),
-                         textcoords='offset points',
-                         fontsize=9,
-                         ha='center')
+        days = (datetime.now().date() - latest).days + 1
+
+    # Токен тратим, только если автоматы пропустят запрос. Пара с известной
+    # ошибкой снимается с очереди, а не возвращается в неё раз за разом.
+    if not breakers.ready(alpha_vantage_pair_breaker('USD', currency)):
+        return [], []
+    if not breakers.ready('alpha_vantage') or not acquire_api_budget('alpha_vantage'):
+        return None, None
+
+    print(f"Получение исторических данных из API для USD/{currency} с {latest or 'начала'}")
+    rates, dates = fetch_direct_historical_range('USD', currency, days, since=latest)
+    if rates:
+        # Бар текущего дня ещё меняется: сохраняем только закрытые дни
+        today = datetime.now().date()
+        closed = [i for i, date in enumerate(dates) if date < today]
+        rates = [rates[i] for i in closed]
+        dates = [dates[i] for i in closed]
+    if rates:
+        save_historical_rates_to_db('USD', currency, rates, dates)
+        update_snapshot_leg(currency, rates, dates, full=latest is None)
+    return rates, dates
+
+def update_snapshot_leg(currency, rates, dates, full=False):
+    import numpy as np
+
+    # Из API пришли только новые даты: дополняем их историей из снимка,
+    # а если там неполная нога или её нет — всей историей из БД.
+    if snapshot.leg_complete(currency):
+        old_rates, old_dates = snapshot.read_leg(currency, None)
+        complete = True
+    else:
+        old_rates, old_dates = get_historical_rates_from_db('USD', currency, HISTORY_MAX_DAYS)
+        complete = old_rates is not None or full
+    if old_rates is not None and len(old_rates):
+        old_dates = np.asarray(old_dates, dtype='datetime64[D]')
+        keep = old_dates < np.datetime64(min(dates), 'D')
+        rates = np.concatenate([np.asarray(rates, dtype=np.float64), np.asarray(old_rates, dtype=np.float64)[keep]])
+        dates = np.concatenate([np.asarray(dates, dtype='datetime64[D]'), old_dates[keep]])
+    limit = HISTORY_MAX_DAYS + HISTORY_ALIGN_MARGIN
+    snapshot.update_snapshot(legs={currency: (rates[:limit], dates[:limit], complete)})
+
+def read_snapshot_leg(currency, days):
+    rates, dates = snapshot.read_leg(currency, days)
+    if rates is None or not len(rates):
+        return None, None
+    return rates.tolist(), dates.astype(object).tolist()
+
+def drain_historical_queue(max_fetches=None):
+    # Берём валюты по приоритету, пока хватает лимита Alpha Vantage;
+    # неполученная валюта возвращается в очередь с тем же приоритетом.
+    fetched = {}
+    while max_fetches is None or len(fetched) < max_fetches:
+        claimed = claim_historical_fetch()
+        if claimed is None:
+            break
+        currency, priority = claimed
+        rates, dates = fetch_usd_leg_from_upstream(currency)
+        if rates is None:
+            enqueue_historical_fetch(currency, priority)
+            break
+        fetched[currency] = (rates, dates)
+    return fetched
+
+def fetch_historical_range(from_curr, to_curr, days=7, priority=PRIORITY_VIEWED):
+    if from_curr == to_curr:
+        return None, None
+
+    legs = {}
+    for currency in {from_curr, to_curr} - {'USD'}:
+        # Ряд берём из снимка, если в нём хватает дней или вся история валюты
+        # (range=max, короткая история); иначе идём в БД
+        rates, dates = read_snapshot_leg(currency, days + HISTORY_ALIGN_MARGIN)
+        if not rates or (len(rates) < days + HISTORY_ALIGN_MARGIN and not snapshot.leg_complete(currency)):
+            db_rates, db_dates = get_historical_rates_from_db('USD', currency, days + HISTORY_ALIGN_MARGIN)
+            if db_rates:
+                rates, dates = db_rates, db_dates
+        if not rates:
+            enqueue_historical_fetch(currency, priority)
+            if REFRESH_MODE == 'inline':
+                rates, dates = drain_historical_queue(max_fetches=1).get(currency, (None, None))
+        if not rates:
+            return None, None
+        legs[currency] = (rates, dates)
+
+    print(f"Используются исторические данные из БД для {from_curr}/{to_curr}")
+    rates, dates = cross_historical_series(legs.get(from_curr), legs.get(to_curr), days)
+    if not rates:
+        return None, None
+    return rates, dates
+
+def refresh_spot_rates():
+    rates = fetch_exchange_rates_from_api()
+    if rates:
+        save_exchange_rates_to_db(rates)
+        snapshot.update_snapshot(rates=rates)
+        exchange_rates_cache['rates'] = rates
+        exchange_rates_cache['timestamp'] = time.time()
+
+def refresh_historical_queue():
+    changed = {currency for currency, (rates, _) in drain_historical_queue().items() if rates}
+    if changed:
+        prerender_charts([
+            (f, t) for f in CURRENCIES for t in CURRENCIES
+            if f != t and (f in changed or t in changed)
+        ])
+
+def refresh_all_historical_rates():
+    for currency in CURRENCIES:
+        if currency != 'USD':
+            enqueue_historical_fetch(currency, PRIORITY_BACKFILL)
+    refresh_historical_queue()
+
+def refresh_all_bank_rates():
+    refresh_shared_bank_rates(force=True)
+
+def build_refresh_jobs():
+    return [
+        {'name': 'spot_rates', 'interval': SPOT_REFRESH_INTERVAL, 'run': refresh_spot_rates},
+        {'name': 'historical_rates', 'interval': HISTORICAL_REFRESH_INTERVAL, 'run': refresh_all_historical_rates},
+        {'name': 'historical_queue', 'interval': HISTORY_QUEUE_INTERVAL, 'run': refresh_historical_queue},
+        {'name': 'bank_rates', 'interval': BANK_REFRESH_INTERVAL, 'run': refresh_all_bank_rates},
+    ]
+
+leader_connection = {'connection': None}
+
+def acquire_refresh_leadership():
+    # GET_LOCK держится, пока живо соединение, поэтому оно не берётся из пула.
+    connection = leader_connection['connection']
+    if connection is not None:
+        if connection.is_connected():
+            return True
+        leader_connection['connection'] = None
+
+    try:
+        connection = mysql.connector.connect(**MYSQL_CONFIG)
+        cursor = connection.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (REFRESH_LOCK_NAME,))
+        acquired = cursor.fetchone()[0] == 1
+        cursor.close()
+    except Error as e:
+        print(f"Ошибка получения блокировки обновления: {e}")
+        return False
+
+    if acquired:
+        print(f"Процесс {os.getpid()} обновляет курсы в фоне")
+        leader_connection['connection'] = connection
+    else:
+        connection.close()
+    return acquired
+
+def start_background_refresh():
+    thread = threading.Thread(
+        target=run_scheduler,
+        args=(build_refresh_jobs(), acquire_refresh_leadership),
+        daemon=True
+    )
+    thread.start()
+    return thread
+
+def get_cached_chart(key):
+    return lru.lru_get(chart_cache, key)
+
+def put_cached_chart(key, img_data):
+    lru.lru_put(chart_cache, key, img_data)
+
+def invalidate_chart_cache(currency):
+    lru.lru_invalidate(chart_cache, lambda key: currency in key[:2])
+
+def get_chart_cache_stats():
+    return lru.lru_stats(chart_cache)
+
+def get_cached_page(key):
+    return lru.lru_get(page_cache, key)
+
+def put_cached_page(key, body):
+    lru.lru_put(page_cache, key, body)
+
+def invalidate_page_cache(currency):
+    # Страница зависит от курсов банков только через target_currency
+    lru.lru_invalidate(page_cache, lambda key: key[3] == currency)
+
+def get_page_cache_stats():
+    return lru.lru_stats(page_cache)
+
+def bank_rates_version(banks):
+    return tuple((bank['name'], bank['buy'], bank['sell'], bank['updated']) for bank in banks)
+
+def historical_data_version(rates, dates, chart_range='7d'):
+    if not rates or not dates:
+        return None
+    return (chart_range, dates[0], rates[0], dates[-1], len(rates))
+
+def chart_version_hash(from_curr, to_curr, version):
+    return hashlib.md5(f'{from_curr}/{to_curr}/{version}'.encode()).hexdigest()
+
+def chart_file_prefix(from_curr, to_curr, version):
+    return f'{from_curr}_{to_curr}_{version[0]}_'
+
+def chart_file_path(from_curr, to_curr, version):
+    name = chart_file_prefix(from_curr, to_curr, version) + chart_version_hash(from_curr, to_curr, version)
+    return os.path.join(CHART_DIR, f'{name}.png')
+
+def read_chart_file(from_curr, to_curr, version):
+    try:
+        with open(chart_file_path(from_curr, to_curr, version), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def write_chart_file(from_curr, to_curr, version, img_data):
+    # Запись через временный файл и os.replace: другие воркеры никогда
+    # не увидят недописанный PNG.
+    path = chart_file_path(from_curr, to_curr, version)
+    try:
+        os.makedirs(CHART_DIR, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(img_data)
+        os.replace(tmp_path, path)
+
+        prefix = chart_file_prefix(from_curr, to_curr, version)
+        for name in os.listdir(CHART_DIR):
+            if name.startswith(prefix) and name.endswith('.png') and name != os.path.basename(path):
+                os.remove(os.path.join(CHART_DIR, name))
+    except OSError as e:
+        print(f"Ошибка сохранения графика {from_curr}/{to_curr}: {e}")
+
+def generate_exchange_chart(from_curr, to_curr, rates=None, dates=None, chart_range='7d'):
+    days, period = CHART_RANGES[chart_range]
+    if rates is None:
+        rates, dates = fetch_historical_range(from_curr, to_curr, days=days)
+
+    version = historical_data_version(rates, dates, chart_range)
+    cache_key = (from_curr, to_curr, version)
+    img_data = get_cached_chart(cache_key)
+    if img_data is not None:
+        return img_data
+
+    if version is None:
+        base_rate = cross_rate(exchange_rates_cache['rates'], from_curr, to_curr)
+        img_data = render_exchange_chart(from_curr, to_curr, rates, dates, base_rate)
+    else:
+        img_data = read_chart_file(from_curr, to_curr, version)
+        if img_data is None:
+            img_data = render_exchange_chart(from_curr, to_curr, rates, dates, period=period)
+            write_chart_file(from_curr, to_curr, version, img_data)
+
+    put_cached_chart(cache_key, img_data)
+    return img_data
+
+def prerender_charts(pairs=None):
+    started = time.perf_counter()
+    if pairs is None:
+        pairs = [(f, t) for f in CURRENCIES for t in CURRENCIES if f != t]
+
+    jobs = []
+    skipped = 0
+    for from_curr, to_curr in pairs:
+        rates, dates = fetch_historical_range(from_curr, to_curr, days=7, priority=PRIORITY_BACKFILL)
+        version = historical_data_version(rates, dates)
+        if version is None or os.path.exists(chart_file_path(from_curr, to_curr, version)):
+            skipped += 1
+            continue
+        jobs.append({
+            'key': (from_curr, to_curr, version),
+            'from': from_curr,
+            'to': to_curr,
+            'rates': rates,
+            'dates': dates,
+            'period': CHART_RANGES['7d'][1]
+        })
+
+    results, failures = render_charts_in_pool(jobs)
+    for (from_curr, to_curr, version), img_data in results.items():
+        write_chart_file(from_curr, to_curr, version, img_data)
+        put_cached_chart((from_curr, to_curr, version), img_data)
+
+    prerender_stats.update({
+        'rendered': len(results),
+        'failed': len(failures),
+        'skipped': skipped,
+        'seconds': round(time.perf_counter() - started, 3),
+        'finished_at': time.time()
+    })
+    print(f"Предрендер графиков: {len(results)} готово, {len(failures)} с ошибками, "
+          f"{skipped} пропущено за {prerender_stats['seconds']} с")
+    return dict(prerender_stats)
+
+@app.before_request
+def start_request_timing():
+    metrics.start_request()
+
+@app.after_request
+def add_server_timing(response):
+    server_timing = metrics.finish_request()
+    if server_timing:
+        response.headers['Server-Timing'] = server_timing
+    return response
+
+def lookup_bank_rates(currency):
+    cached = bank_rates_memory.get(currency)
+    if cached and time.time() - cached[1] < BANK_MEMORY_TTL:
+        metrics.count_cache('bank_lookup', 'hit')
+        return cached[0]
+
+    banks = get_bank_rates_from_db(currency)
+    metrics.count_cache('bank_db', 'hit' if banks else 'miss')
     
-    plt.tight_layout()
+    if not banks and REFRESH_MODE == 'inline':
+        if refresh_shared_bank_rates():
+            banks = get_bank_rates_from_db(currency)
+        if not banks:
+            banks = get_bank_rates(currency)
 
-    img_buf = BytesIO()
-    plt.savefig(img_buf, format='png', dpi=100)
-    img_buf.seek(0)
-    img_data = base64.b64encode(img_buf.read()).decode('utf-8')
-    plt.close()
+    if not banks:
+        # Последние сохранённые курсы лучше заглушки, даже если они устарели
+        banks, _ = snapshot.read_banks(currency)
+        if banks:
+            return [dict(bank, stale=True) for bank in banks]
     
-    return img_data
+    if not banks:
+        return bank_rates_placeholder(currency)
+
+    bank_rates_memory[currency] = (banks, time.time())
+    return banks
+
+def bank_rates_placeholder(currency):
+    return [{
+        'name': 'Данные временно недоступны',
+        'buy': 0,
+        'sell': 0,
+        'updated': '-',
+        'currency': currency
+    }]
+
+def get_page_executor():
+    # Потоки пула не переживают fork, поэтому пул создаётся в каждом воркере
+    pid = os.getpid()
+    with page_executor_lock:
+        if page_executor['executor'] is None or page_executor['pid'] != pid:
+            page_executor['executor'] = ThreadPoolExecutor(max_workers=PAGE_WORKERS)
+            page_executor['pid'] = pid
+        return page_executor['executor']
+
+def start_bank_lookup(currency):
+    # Не больше одного поиска на валюту: страницы, пришедшие во время
+    # долгого поиска, ждут его же, а не занимают новые потоки пула.
+    pid = os.getpid()
+    with bank_lookups_lock:
+        lookup = bank_lookups.get(currency)
+        if lookup is None or lookup['pid'] != pid or lookup['future'].done():
+            future = get_page_executor().submit(metrics.run_timed, lookup_bank_rates, currency)
+            lookup = {'future': future, 'pid': pid}
+            bank_lookups[currency] = lookup
+        return lookup['future']
+
+def wait_page_section(name, future, deadline_at):
+    # Не успевшая секция получает None, а сама задача дорабатывает
+    # в фоне и прогревает кэши для следующих запросов.
+    with metrics.measure('page_fanout'):
+        wait([future], timeout=max(deadline_at - time.monotonic(), 0))
+    if not future.done():
+        print(f"Раздел страницы {name} не готов к сроку")
+        metrics.count_cache(f'page_{name}', 'timeout')
+        return None
+    try:
+        result, stages = future.result()
+    except Exception as e:
+        print(f"Ошибка раздела страницы {name}: {e}")
+        return None
+    metrics.add_stages(stages)
+    return result
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    exchange_rates = fetch_exchange_rates()
-    
-    if not exchange_rates:
-        return "Ошибка получения данных. Пожалуйста, попробуйте позже.", 500
-
     from_currency = request.form.get('from_currency', 'SGD')
     to_currency = request.form.get('to_currency', 'USD')
     
@@ -499,45 +1302,204 @@ def index():
     except ValueError:
         amount = 1000.00
 
-    rate = exchange_rates.get(from_currency, {}).get(to_currency, 1.0)
-    converted_amount = round(amount * rate, 2)
+    target_currency = from_currency if from_currency in ['USD', 'EUR'] else 'USD'
 
-    chart_img = generate_exchange_chart(from_currency, to_currency)
+    # Банки ищем в пуле, пока курсы читаются в потоке запроса: обычно это
+    # попадание в память, и оно не должно стоять в очереди за банками.
+    started = time.monotonic()
+    banks_future = start_bank_lookup(target_currency) if PAGE_FANOUT else None
+    exchange_rates = fetch_exchange_rates()
+    
+    if not exchange_rates:
+        return "Ошибка получения данных. Пожалуйста, попробуйте позже.", 500
+
+    if banks_future is None:
+        banks = lookup_bank_rates(target_currency)
+    else:
+        banks = wait_page_section('banks', banks_future, started + PAGE_BANKS_DEADLINE)
+    banks = banks or bank_rates_placeholder(target_currency)
+
+    rate = cross_rate(exchange_rates, from_currency, to_currency)
+    converted_amount = round(amount * rate, 2)
 
     update_time = datetime.now().strftime('%d.%m.%Y %H:%M')
 
-    target_currency = from_currency if from_currency in ['USD', 'EUR'] else 'USD'
-    
-    banks = get_bank_rates_from_db(target_currency)
-    
-    if not banks:
-        banks = get_bank_rates(target_currency)
-        if banks:
-            save_bank_rates_to_db(banks)
-    
-    if not banks:
-        banks = [{
-            'name': 'Данные временно недоступны',
-            'buy': 0,
-            'sell': 0,
-            'updated': '-',
-            'currency': target_currency
-        }]
-
-    return render_template(
-        'index.html',
-        from_currency=from_currency,
-        to_currency=to_currency,
-        amount=amount,
-        converted_amount=converted_amount,
-        rate=rate,
-        chart_img=chart_img,
-        update_time=update_time,
-        currency_names=CURRENCY_NAMES,
-        banks=banks,
-        currencies=CURRENCIES,
-        target_currency=target_currency
+    # Страница целиком определяется этим ключом; произвольные валюты
+    # из формы не кэшируем, чтобы не вытеснять ими обычные страницы.
+    cache_key = None
+    if from_currency in CURRENCIES and to_currency in CURRENCIES:
+        cache_key = (from_currency, to_currency, amount, target_currency,
+                     exchange_rates['timestamp'], bank_rates_version(banks), update_time)
+        body = get_cached_page(cache_key)
+        if body is not None:
+            return body
+
+    with metrics.measure('template_render'):
+        body = render_template(
+            'index.html',
+            from_currency=from_currency,
+            to_currency=to_currency,
+            amount=amount,
+            converted_amount=converted_amount,
+            rate=rate,
+            update_time=update_time,
+            currency_names=CURRENCY_NAMES,
+            chart_ranges=CHART_RANGES,
+            banks=banks,
+            currencies=CURRENCIES,
+            target_currency=target_currency
+        )
+
+    if cache_key is not None:
+        put_cached_page(cache_key, body)
+    return body
+
+@app.route('/api/convert')
+def api_convert():
+    exchange_rates = fetch_exchange_rates()
+    if not exchange_rates:
+        return jsonify({'error': 'Курсы валют временно недоступны'}), 503
+
+    from_currency = request.args.get('from', 'SGD')
+    to_currency = request.args.get('to', 'USD')
+    if from_currency not in exchange_rates['index'] or to_currency not in exchange_rates['index']:
+        return jsonify({'error': 'Неизвестная валюта'}), 400
+
+    try:
+        amount = float(request.args.get('amount', 1000.00))
+    except ValueError:
+        return jsonify({'error': 'Некорректная сумма'}), 400
+    # float() принимает nan и inf, а они дают невалидный JSON в ответе
+    if not math.isfinite(amount):
+        return jsonify({'error': 'Некорректная сумма'}), 400
+
+    rate = cross_rate(exchange_rates, from_currency, to_currency)
+    # Конечная сумма может переполниться при умножении на курс (1e307 RUB)
+    converted_amount = amount * rate
+    if not math.isfinite(converted_amount):
+        return jsonify({'error': 'Некорректная сумма'}), 400
+    return jsonify({
+        'from': from_currency,
+        'to': to_currency,
+        'amount': amount,
+        'rate': rate,
+        'converted_amount': round(converted_amount, 2),
+        'timestamp': exchange_rates['timestamp']
+    })
+
+BATCH_COLUMNS = ['amount', 'from', 'to']
+BATCH_CHUNK_SIZE = 10000
+
+def read_batch_request():
+    import pandas as pd
+
+    if request.is_json:
+        data = request.get_json(silent=True)
+        rows = data.get('rows') if isinstance(data, dict) else data
+        if not isinstance(rows, list):
+            raise ValueError("ожидается список строк или объект с полем rows")
+        # Строки одного вида: либо объекты с ключами, либо списки по порядку столбцов
+        if all(isinstance(row, dict) for row in rows):
+            frame = pd.DataFrame.from_records(rows, columns=BATCH_COLUMNS)
+        elif all(isinstance(row, list) for row in rows):
+            frame = pd.DataFrame(rows, columns=BATCH_COLUMNS)
+        else:
+            raise ValueError("строки должны быть либо объектами, либо списками")
+        # В JSON код валюты может оказаться списком или числом: такие ячейки
+        # считаем пустыми, и строка получает rate = null, как неизвестная валюта
+        for column in ('from', 'to'):
+            frame[column] = frame[column].where(frame[column].map(type) == str, None)
+        return frame, 'json'
+
+    source = request.files['file'] if 'file' in request.files else BytesIO(request.get_data())
+    frame = pd.read_csv(source, dtype={'from': str, 'to': str})
+    if not set(BATCH_COLUMNS) <= set(frame.columns):
+        raise ValueError(f"CSV должен содержать столбцы {', '.join(BATCH_COLUMNS)}")
+    return frame[BATCH_COLUMNS], 'csv'
+
+def stream_batch_csv(frame):
+    yield ','.join(frame.columns) + '\n'
+    for start in range(0, len(frame), BATCH_CHUNK_SIZE):
+        yield frame.iloc[start:start + BATCH_CHUNK_SIZE].to_csv(header=False, index=False)
+
+def stream_batch_json(frame, timestamp):
+    yield f'{{"timestamp": {timestamp}, "results": ['
+    for start in range(0, len(frame), BATCH_CHUNK_SIZE):
+        chunk = frame.iloc[start:start + BATCH_CHUNK_SIZE].to_json(orient='records', double_precision=15)
+        yield (',' if start else '') + chunk[1:-1]
+    yield ']}'
+
+@app.route('/api/convert/batch', methods=['POST'])
+def api_convert_batch():
+    import numpy as np
+    import pandas as pd
+
+    exchange_rates = fetch_exchange_rates()
+    if not exchange_rates:
+        return jsonify({'error': 'Курсы валют временно недоступны'}), 503
+
+    try:
+        frame, output_format = read_batch_request()
+    except (ValueError, KeyError, TypeError, pd.errors.ParserError) as e:
+        return jsonify({'error': f'Некорректные данные: {e}'}), 400
+
+    amounts = pd.to_numeric(frame['amount'], errors='coerce').to_numpy(dtype=np.float64)
+    pair_rates, converted = convert_batch(
+        exchange_rates, amounts, frame['from'].to_numpy(), frame['to'].to_numpy()
     )
+    frame = frame.assign(amount=amounts, rate=pair_rates, converted_amount=converted)
+
+    timestamp = exchange_rates['timestamp']
+    headers = {'X-Rates-Timestamp': str(timestamp)}
+    if output_format == 'csv':
+        return Response(stream_batch_csv(frame), mimetype='text/csv', headers=headers)
+    return Response(stream_batch_json(frame, timestamp), mimetype='application/json', headers=headers)
+
+@app.route('/chart/<from_curr>/<to_curr>.png')
+def exchange_chart_png(from_curr, to_curr):
+    chart_range = request.args.get('range', '7d')
+    if from_curr not in CURRENCIES or to_curr not in CURRENCIES or chart_range not in CHART_RANGES:
+        abort(404)
+
+    rates, dates = fetch_historical_range(from_curr, to_curr, days=CHART_RANGES[chart_range][0])
+    version = historical_data_version(rates, dates, chart_range)
+
+    response = make_response()
+    response.mimetype = 'image/png'
+    if version is None:
+        response.cache_control.no_cache = True
+    else:
+        response.set_etag(chart_version_hash(from_curr, to_curr, version))
+        response.last_modified = datetime.combine(max(dates), datetime.min.time())
+        response.cache_control.public = True
+        response.cache_control.max_age = CHART_MAX_AGE
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+    response.set_data(generate_exchange_chart(from_curr, to_curr, rates, dates, chart_range))
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    body = metrics.render_metrics({
+        'chart_cache': get_chart_cache_stats(),
+        'page_cache': get_page_cache_stats(),
+        'mysql_pool': get_mysql_pool_stats()
+    }, labeled={'breaker': ('upstream', breakers.get_breaker_stats())})
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify({
+        'chart_cache': get_chart_cache_stats(),
+        'mysql_pool': get_mysql_pool_stats(),
+        'page_cache': get_page_cache_stats(),
+        'prerender': prerender_stats,
+        'breakers': breakers.get_breaker_stats()
+    })
 
 if __name__ == '__main__':
+    if REFRESH_MODE == 'thread':
+        start_background_refresh()
     app.run(debug=True)
@@ -1,22 +1,102 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 from datetime import datetime
+import json
 import random
 import time
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+from metrics import timed, count_cache
+import breakers
 
 bank_cache = {}
+last_bank_rates = {}
+source_cache = {}
+http_session = {'session': None, 'pid': None}
 CACHE_TTL = 1800
+PARTIAL_CACHE_TTL = 60
+BANKS_DEADLINE = float(os.getenv('BANKS_DEADLINE', 12))
+BANK_TIMEOUT = breakers.UPSTREAM_TIMEOUT
+BANK_CURRENCIES = ['USD', 'EUR']
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 
-def parse_uralsub(currency='USD'):
+def get_session():
+    # Отдельная сессия на процесс: keep-alive сокеты нельзя делить после fork.
+    pid = os.getpid()
+    if http_session['session'] is None or http_session['pid'] != pid:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        http_session['session'] = session
+        http_session['pid'] = pid
+    return http_session['session']
+
+def fetch_source(upstream, url, headers=None):
+    breakers.check(upstream)
+    request_headers = dict(headers or {})
+    cached = source_cache.get(url)
+    if cached:
+        if cached['etag']:
+            request_headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            request_headers['If-Modified-Since'] = cached['last_modified']
+
+    try:
+        response = get_session().get(url, headers=request_headers, timeout=BANK_TIMEOUT)
+        if response.status_code != 304:
+            response.raise_for_status()
+    except requests.RequestException as e:
+        breakers.record_failure(upstream, e)
+        raise
+    breakers.record_success(upstream)
+
+    if response.status_code == 304 and cached:
+        return cached['text']
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if response.status_code == 200 and (etag or last_modified):
+        source_cache[url] = {
+            'etag': etag,
+            'last_modified': last_modified,
+            'text': response.text
+        }
+    return response.text
+
+def get_html_parser():
+    try:
+        import lxml
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+def find_tables(text, class_name):
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    # Разбираем только нужные таблицы; если разметка их не отдала,
+    # повторяем полный разбор как раньше. При разборе class приходит
+    # в фильтр одной строкой, поэтому делим её на классы сами.
+    def has_class(value):
+        if value is None:
+            return False
+        return class_name in (value.split() if isinstance(value, str) else value)
+
+    strainer = SoupStrainer('table', class_=has_class)
+    tables = BeautifulSoup(text, get_html_parser(), parse_only=strainer).find_all('table', class_=class_name)
+    if not tables:
+        tables = BeautifulSoup(text, 'html.parser').find_all('table', class_=class_name)
+    return tables
+
+@timed('upstream_bank_uralsib')
+def parse_uralsub(currencies=BANK_CURRENCIES):
     try:
         url = "https://www.sberbank.ru/ru/quotes/currencies"
         headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            'User-Agent': USER_AGENT
         }
-        response = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        tables = soup.find_all('table', class_='kitt-table')
+        rates = {}
+        tables = find_tables(fetch_source('bank_uralsib', url, headers), 'kitt-table')
         for table in tables:
             rows = table.find_all('tr')
             for row in rows:
@@ -25,143 +105,189 @@ def parse_uralsub(currency='USD'):
                     continue
                     
                 currency_cell = cells[0].get_text(strip=True)
-                if currency in currency_cell:
-                    buy_rate = cells[2].get_text(strip=True).replace(',', '.')
-                    sell_rate = cells[3].get_text(strip=True).replace(',', '.')
-                    
-                    return {
-                        'buy': float(buy_rate),
-                        'sell': float(sell_rate),
-                        'updated': datetime.now().strftime('%H:%M')
-                    }
-        return None
+                for currency in currencies:
+                    if currency in currency_cell and currency not in rates:
+                        buy_rate = cells[2].get_text(strip=True).replace(',', '.')
+                        sell_rate = cells[3].get_text(strip=True).replace(',', '.')
+                        
+                        rates[currency] = {
+                            'buy': float(buy_rate),
+                            'sell': float(sell_rate),
+                            'updated': datetime.now().strftime('%H:%M')
+                        }
+        return rates
     except Exception as e:
         print(f"[Uralsub Parser] Ошибка: {e}")
-        return None
-def parse_vtb(currency='USD'):
+        return {}
+@timed('upstream_bank_vtb')
+def parse_vtb(currencies=BANK_CURRENCIES):
     try:
         url = "https://www.vtb.ru/personal/platezhi-i-perevody/obmen-valjuty/"
         headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            'User-Agent': USER_AGENT
         }
-        response = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        table = soup.find('table', class_='rates-table')
-        if not table:
-            return None
+        tables = find_tables(fetch_source('bank_vtb', url, headers), 'rates-table')
+        if not tables:
+            return {}
+        table = tables[0]
             
+        rates = {}
         for row in table.find_all('tr'):
             currency_cell = row.find('span', class_='rates-table__code')
-            if currency_cell and currency in currency_cell.text:
-                buy_cell = row.find('td', class_='rates-table__buy')
-                sell_cell = row.find('td', class_='rates-table__sell')
-                
-                if buy_cell and sell_cell:
-                    buy_rate = buy_cell.find('span', class_='rates-table__value').text.replace(',', '.')
-                    sell_rate = sell_cell.find('span', class_='rates-table__value').text.replace(',', '.')
+            if not currency_cell:
+                continue
+            for currency in currencies:
+                if currency in currency_cell.text and currency not in rates:
+                    buy_cell = row.find('td', class_='rates-table__buy')
+                    sell_cell = row.find('td', class_='rates-table__sell')
                     
-                    return {
-                        'buy': float(buy_rate),
-                        'sell': float(sell_rate),
-                        'updated': datetime.now().strftime('%H:%M')
-                    }
-        return None
+                    if buy_cell and sell_cell:
+                        buy_rate = buy_cell.find('span', class_='rates-table__value').text.replace(',', '.')
+                        sell_rate = sell_cell.find('span', class_='rates-table__value').text.replace(',', '.')
+                        
+                        rates[currency] = {
+                            'buy': float(buy_rate),
+                            'sell': float(sell_rate),
+                            'updated': datetime.now().strftime('%H:%M')
+                        }
+        return rates
     except Exception as e:
         print(f"[VTB Parser] Ошибка: {e}")
-        return None
+        return {}
 
-def parse_tinkoff(currency='USD'):
+@timed('upstream_bank_tinkoff')
+def parse_tinkoff(currencies=BANK_CURRENCIES):
     try:
-        response = requests.get(
-            'https://api.tinkoff.ru/v1/currency_rates', 
-            timeout=10
-        )
-        data = response.json()
+        data = json.loads(fetch_source('bank_tinkoff', 'https://api.tinkoff.ru/v1/currency_rates'))
         
+        rates = {}
         for rate in data['payload']['rates']:
+            currency = rate['fromCurrency']['name']
             if (rate['category'] == 'DepositPayments' and 
-                rate['fromCurrency']['name'] == currency and
+                currency in currencies and
+                currency not in rates and
                 rate['toCurrency']['name'] == 'RUB'):
                 
-                return {
+                rates[currency] = {
                     'buy': rate['buy'],
                     'sell': rate['sell'],
                     'updated': datetime.now().strftime('%H:%M')
                 }
-        return None
+        return rates
     except Exception as e:
         print(f"[Tinkoff Parser] Ошибка: {e}")
-        return None
-def parse_alfabank(currency='USD'):
+        return {}
+@timed('upstream_bank_alfabank')
+def parse_alfabank(currencies=BANK_CURRENCIES):
     try:
-        url = "https://alfabank.ru/api/v1/scrooge/currencies/alfa-rates?currencyCode.in={}&rateType.in=rateCBRF,rateCard,rateCB,rateTBB,rateSB".format(currency)
+        url = "https://alfabank.ru/api/v1/scrooge/currencies/alfa-rates?currencyCode.in={}&rateType.in=rateCBRF,rateCard,rateCB,rateTBB,rateSB".format(','.join(currencies))
         headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'User-Agent': USER_AGENT,
             'Accept': 'application/json',
         }
-        response = requests.get(url, headers=headers, timeout=10)
-        data = response.json()
+        data = json.loads(fetch_source('bank_alfabank', url, headers))
 
+        rates = {}
         for rate in data['data']:
-            if rate['currencyCode'] == currency:
-                if 'rate' in rate:
-                    return {
-                        'buy': rate['rate']['buy'],
-                        'sell': rate['rate']['sell'],
+            currency = rate['currencyCode']
+            if currency not in currencies or currency in rates:
+                continue
+            if 'rate' in rate:
+                rates[currency] = {
+                    'buy': rate['rate']['buy'],
+                    'sell': rate['rate']['sell'],
+                    'updated': datetime.now().strftime('%H:%M')
+                }
+                continue
+            for rate_type in rate['rates']:
+                if rate_type['rateType'] == 'rateCard':
+                    rates[currency] = {
+                        'buy': rate_type['buy']['value'],
+                        'sell': rate_type['sell']['value'],
                         'updated': datetime.now().strftime('%H:%M')
                     }
-                for rate_type in rate['rates']:
-                    if rate_type['rateType'] == 'rateCard':
-                        return {
-                            'buy': rate_type['buy']['value'],
-                            'sell': rate_type['sell']['value'],
-                            'updated': datetime.now().strftime('%H:%M')
-                        }
-        return None
+                    break
+        return rates
     except Exception as e:
         print(f"[Alfabank Parser] Ошибка: {e}")
-        return None
+        return {}
 
-def get_bank_rates(currency='USD'):
-    cache_key = f"rates_{currency}"
-    
-    if cache_key in bank_cache:
-        cached_data, timestamp = bank_cache[cache_key]
-        if time.time() - timestamp < CACHE_TTL:
-            return cached_data
+BANK_PARSERS = [
+    {'name': 'Уралсиб', 'parser': parse_uralsub},
+    {'name': 'ВТБ', 'parser': parse_vtb},
+    {'name': 'Тинькофф', 'parser': parse_tinkoff},
+    {'name': 'Альфа-Банк', 'parser': parse_alfabank},
+]
 
-    parsers = [
-        {'name': 'Уралсиб', 'parser': parse_uralsub},
-        {'name': 'ВТБ', 'parser': parse_vtb},
-        {'name': 'Тинькофф', 'parser': parse_tinkoff},
-        {'name': 'Альфа-Банк', 'parser': parse_alfabank},
-    ]
-    
-    results = []
-    for bank in parsers:
-        try:
-            rates = bank['parser'](currency)
+def refresh_bank_rates(currencies=BANK_CURRENCIES):
+    executor = ThreadPoolExecutor(max_workers=len(BANK_PARSERS))
+    futures = {
+        executor.submit(bank['parser'], currencies): bank
+        for bank in BANK_PARSERS
+    }
+    done, _ = wait(futures, timeout=BANKS_DEADLINE)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    bank_rates = {}
+    for future, bank in futures.items():
+        rates = {}
+        if future in done:
+            try:
+                rates = future.result()
+            except Exception as e:
+                print(f"Ошибка при обработке банка {bank['name']}: {e}")
+        else:
+            print(f"Банк {bank['name']} не ответил за {BANKS_DEADLINE} с")
+        bank_rates[bank['name']] = rates
+
+    now = time.time()
+    results_by_currency = {}
+    for currency in currencies:
+        results = []
+        complete = True
+        for bank in BANK_PARSERS:
+            rates = bank_rates[bank['name']].get(currency)
             if rates:
-                results.append({
+                result = {
                     'name': bank['name'],
                     'buy': rates['buy'],
                     'sell': rates['sell'],
                     'updated': rates['updated'],
                     'currency': currency
-                })
-            time.sleep(0.5)
-        except Exception as e:
-            print(f"Ошибка при обработке банка {bank['name']}: {e}")
+                }
+                last_bank_rates[(bank['name'], currency)] = result
+                results.append(result)
+                continue
+
+            complete = False
+            last_result = last_bank_rates.get((bank['name'], currency))
+            if last_result:
+                results.append(dict(last_result, stale=True))
+        
+        if not results:
+            results.append({
+                'name': 'Данные временно недоступны',
+                'buy': 0,
+                'sell': 0,
+                'updated': '-',
+                'currency': currency
+            })
+
+        ttl = CACHE_TTL if complete else PARTIAL_CACHE_TTL
+        bank_cache[f"rates_{currency}"] = (results, now, ttl)
+        results_by_currency[currency] = results
+    return results_by_currency
+
+def get_bank_rates(currency='USD'):
+    cache_key = f"rates_{currency}"
     
-    if not results:
-        results.append({
-            'name': 'Данные временно недоступны',
-            'buy': 0,
-            'sell': 0,
-            'updated': '-',
-            'currency': currency
-        })
-
-    bank_cache[cache_key] = (results, time.time())
-    return results
\ No newline at end of file
+    if cache_key in bank_cache:
+        cached_data, timestamp, ttl = bank_cache[cache_key]
+        if time.time() - timestamp < ttl:
+            count_cache('bank_memory', 'hit')
+            return cached_data
+
+    count_cache('bank_memory', 'miss')
+    currencies = BANK_CURRENCIES if currency in BANK_CURRENCIES else BANK_CURRENCIES + [currency]
+    refresh_bank_rates(currencies)
+    return bank_cache[cache_key][0]
\ No newline at end of file
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 3))
+BREAKER_BASE_DELAY = float(os.getenv('BREAKER_BASE_DELAY', 30))
+BREAKER_MAX_DELAY = float(os.getenv('BREAKER_MAX_DELAY', 1800))
+UPSTREAM_TIMEOUT = (float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05)),
+                    float(os.getenv('UPSTREAM_READ_TIMEOUT', 10)))
+
+breakers = {}
+breakers_lock = threading.Lock()
+
+class UpstreamUnavailable(Exception):
+    pass
+
+def get_breaker(name):
+    breaker = breakers.get(name)
+    if breaker is None:
+        breaker = {
+            'state': 'closed',
+            'failures': 0,
+            'trips': 0,
+            'retry_at': 0.0,
+            'rejected': 0,
+            'last_error': None
+        }
+        breakers[name] = breaker
+    return breaker
+
+def allow(name):
+    # Открытый автомат отвечает отказом без сетевого вызова; по истечении
+    # паузы пропускаем ровно одну пробу, остальные ждут её результата.
+    now = time.monotonic()
+    with breakers_lock:
+        breaker = get_breaker(name)
+        if breaker['state'] == 'closed':
+            return True
+        if breaker['state'] == 'open' and now >= breaker['retry_at']:
+            breaker['state'] = 'half_open'
+            breaker['retry_at'] = now + UPSTREAM_TIMEOUT[0] + UPSTREAM_TIMEOUT[1]
+            return True
+        if breaker['state'] == 'half_open' and now >= breaker['retry_at']:
+            # Проба зависла дольше таймаута — разрешаем следующую
+            breaker['retry_at'] = now + UPSTREAM_TIMEOUT[0] + UPSTREAM_TIMEOUT[1]
+            return True
+        breaker['rejected'] += 1
+        return False
+
+def check(name):
+    if not allow(name):
+        raise UpstreamUnavailable(f"{name} временно недоступен")
+
+def record_success(name):
+    with breakers_lock:
+        breaker = get_breaker(name)
+        if breaker['state'] != 'closed':
+            print(f"[Breaker] {name} снова доступен")
+        breaker['state'] = 'closed'
+        breaker['failures'] = 0
+        breaker['trips'] = 0
+        breaker['last_error'] = None
+
+def ready(name):
+    # Проверка без пробы: пропустит ли автомат запрос прямо сейчас
+    with breakers_lock:
+        breaker = breakers.get(name)
+        return breaker is None or breaker['state'] == 'closed' or time.monotonic() >= breaker['retry_at']
+
+def record_failure(name, error, delay=None):
+    # delay задаёт явную паузу (например, при лимите запросов) и открывает
+    # автомат сразу, без накопления порога ошибок.
+    now = time.monotonic()
+    with breakers_lock:
+        breaker = get_breaker(name)
+        breaker['failures'] += 1
+        breaker['last_error'] = str(error)
+        if (delay is None and breaker['state'] == 'closed'
+                and breaker['failures'] < BREAKER_FAILURE_THRESHOLD):
+            return
+
+        if delay is None:
+            delay = min(BREAKER_BASE_DELAY * 2 ** breaker['trips'], BREAKER_MAX_DELAY)
+        breaker['trips'] += 1
+        breaker['state'] = 'open'
+        breaker['retry_at'] = now + delay
+    print(f"[Breaker] {name} отключён на {delay:.0f} с: {error}")
+
+def get_breaker_stats():
+    stats = {}
+    with breakers_lock:
+        for name, breaker in breakers.items():
+            stats[name] = {
+                'open': int(breaker['state'] != 'closed'),
+                'failures': breaker['failures'],
+                'rejected': breaker['rejected']
+            }
+    return stats
@@ -0,0 +1,50 @@
+import os
+import time
+
+ALPHA_VANTAGE_PER_MINUTE = int(os.getenv('ALPHA_VANTAGE_PER_MINUTE', 5))
+ALPHA_VANTAGE_PER_DAY = int(os.getenv('ALPHA_VANTAGE_PER_DAY', 25))
+# Ёмкость ведра: при burst > 1 в скользящую минуту попадёт больше
+# per_minute запросов (burst плюс пополнение за минуту).
+ALPHA_VANTAGE_BURST = int(os.getenv('ALPHA_VANTAGE_BURST', 1))
+PRIORITY_VIEWED = 0
+PRIORITY_BACKFILL = 1
+
+def budget_day(now):
+    # Суточный лимит Alpha Vantage сбрасывается по UTC
+    return time.strftime('%Y-%m-%d', time.gmtime(now))
+
+def new_bucket(now, burst=ALPHA_VANTAGE_BURST):
+    return {'tokens': float(burst), 'updated': now, 'day': budget_day(now), 'day_used': 0}
+
+def take_token(bucket, now, per_minute=ALPHA_VANTAGE_PER_MINUTE, per_day=ALPHA_VANTAGE_PER_DAY,
+               burst=ALPHA_VANTAGE_BURST):
+    elapsed = max(now - bucket['updated'], 0)
+    bucket['tokens'] = min(float(burst), bucket['tokens'] + elapsed * per_minute / 60.0)
+    bucket['updated'] = now
+
+    day = budget_day(now)
+    if bucket['day'] != day:
+        bucket['day'] = day
+        bucket['day_used'] = 0
+
+    if bucket['tokens'] < 1 or bucket['day_used'] >= per_day:
+        return False
+    bucket['tokens'] -= 1
+    bucket['day_used'] += 1
+    return True
+
+def enqueue(queue, key, priority, now):
+    # Повторный запрос того же ключа не дублируется, а только
+    # повышает приоритет; время постановки в очередь сохраняется.
+    current = queue.get(key)
+    if current is None:
+        queue[key] = (priority, now)
+    elif priority < current[0]:
+        queue[key] = (priority, current[1])
+
+def pop_next(queue):
+    if not queue:
+        return None
+    key = min(queue, key=queue.get)
+    priority, _ = queue.pop(key)
+    return key, priority
@@ -0,0 +1,133 @@
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from io import BytesIO
+from multiprocessing import get_context
+
+from metrics import timed
+
+PRERENDER_WORKERS = int(os.getenv('PRERENDER_WORKERS', os.cpu_count() or 1))
+CHART_POINT_BUDGET = int(os.getenv('CHART_POINT_BUDGET', 200))
+CHART_DENSE_POINTS = 15
+
+def downsample_series(rates, dates, budget=CHART_POINT_BUDGET):
+    # Min/max по корзинам: на каждую корзину оставляем минимум и максимум,
+    # так что пики сохраняются, а число точек не превышает budget.
+    import numpy as np
+
+    n = len(rates)
+    if n <= budget:
+        return rates, dates
+
+    size = -(-n // (budget // 2))
+    buckets = -(-n // size)
+    values = np.full(buckets * size, np.nan)
+    values[:n] = rates
+    grid = values.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+
+    idx = np.unique(np.concatenate([
+        offsets + np.nanargmin(grid, axis=1),
+        offsets + np.nanargmax(grid, axis=1),
+        [0, n - 1]
+    ]))
+    return np.asarray(rates, dtype=np.float64)[idx].tolist(), [dates[i] for i in idx]
+
+@timed('chart_render')
+def render_exchange_chart(from_curr, to_curr, rates, dates, base_rate=1.0, period='за 7 дней'):
+    # Без pyplot: у каждого вызова своя Figure, поэтому рендер можно
+    # выполнять параллельно в потоках (gthread, пул потоков).
+    from matplotlib.dates import AutoDateLocator, ConciseDateFormatter, date2num
+    from matplotlib.figure import Figure
+    import numpy as np
+
+    if rates and dates:
+        rates, dates = downsample_series(rates, dates)
+        chart_title = f'Динамика курса {from_curr}/{to_curr} {period}'
+    else:
+        dates = [datetime.now().date() - timedelta(days=i) for i in range(6, -1, -1)]
+        rates = [base_rate * (1 + random.uniform(-0.02, 0.02)) for _ in range(7)]
+
+        for i in range(1, 7):
+            volatility = 0.015 if 'JPY' in (from_curr, to_curr) else 0.008
+            change = random.uniform(-volatility, volatility)
+            rates[i] = rates[i-1] * (1 + change)
+
+        rates[-1] = base_rate
+        chart_title = f'Динамика курса {from_curr}/{to_curr}'
+
+    dense = len(rates) > CHART_DENSE_POINTS
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.plot(dates, rates, marker=None if dense else 'o', linestyle='-', color='#1F2261', 
+            markersize=6, linewidth=1.5 if dense else 2.5, markerfacecolor='white', markeredgewidth=1.5)
+    ax.fill_between(dates, rates, min(rates)*0.99, color='#1F2261', alpha=0.1)
+
+    if len(rates) > 1:
+        x_dates = date2num(dates)
+        z = np.polyfit(x_dates, rates, 1)
+        p = np.poly1d(z)
+        ax.plot(dates, p(x_dates), 'r--', linewidth=1.5, alpha=0.7)
+    
+    ax.set_title(chart_title, fontsize=14, pad=20)
+    ax.set_xlabel('Дата', fontsize=12)
+    ax.set_ylabel(f'Курс {from_curr} к {to_curr}', fontsize=12)
+    ax.grid(True, linestyle='--', alpha=0.7)
+
+    if dense:
+        locator = AutoDateLocator()
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+    else:
+        date_labels = [date.strftime('%d-%m') for date in dates]
+        ax.set_xticks(dates, date_labels, rotation=15)
+
+    if rates[0] != 0:
+        change_percent = ((rates[-1] - rates[0]) / rates[0]) * 100
+        change_text = f"Изменение: {change_percent:+.2f}%"
+        change_color = 'green' if change_percent >= 0 else 'red'
+        ax.annotate(change_text, xy=(0.95, 0.95), xycoords='axes fraction',
+                    color=change_color, fontsize=12,
+                    bbox=dict(boxstyle='round,pad=0.3', fc='white', ec=change_color, alpha=0.8))
+
+    for i, (date, rate) in enumerate(zip(dates, rates)):
+        if i == 0 or i == len(rates)-1 or (i % 2 == 0 and not dense):
+            fmt = '.2f' if to_curr == 'RUB' or from_curr == 'RUB' else '.4f'
+            ax.annotate(f'{rate:{fmt}}', 
+                        xy=(date, rate),
+                        xytext=(0, 10),
+                        textcoords='offset points',
+                        fontsize=9,
+                        ha='center')
+    
+    fig.tight_layout()
+
+    img_buf = BytesIO()
+    fig.savefig(img_buf, format='png', dpi=100)
+    img_data = img_buf.getvalue()
+
+    return img_data
+
+def render_chart_job(job):
+    return render_exchange_chart(job['from'], job['to'], job['rates'], job['dates'], period=job['period'])
+
+def render_charts_in_pool(jobs, max_workers=PRERENDER_WORKERS):
+    # spawn, а не fork: процесс веб-воркера многопоточный, и дочерним
+    # процессам нужен только этот модуль, а не всё приложение.
+    results = {}
+    failures = {}
+    if not jobs:
+        return results, failures
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context('spawn')) as executor:
+        futures = {executor.submit(render_chart_job, job): job['key'] for job in jobs}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                print(f"[Charts] Ошибка рендера {key[0]}/{key[1]}: {e}")
+                failures[key] = str(e)
+    return results, failures
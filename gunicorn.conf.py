@@ -0,0 +1,7 @@
+def post_worker_init(worker):
+    # Фоновое обновление запускает только сервер: при импорте app его
+    # запустили бы и короткоживущие команды flask init-db / prerender-charts.
+    import app
+
+    if app.REFRESH_MODE == 'thread':
+        app.start_background_refresh()
@@ -0,0 +1,51 @@
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# Ограниченный LRU-кэш в памяти процесса: у каждого кэша свои блокировка
+# и счётчики, попадания и промахи также уходят в metrics под именем кэша.
+
+def new_lru(name, max_size):
+    return {
+        'name': name,
+        'max_size': max_size,
+        'items': OrderedDict(),
+        'stats': {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0},
+        'lock': threading.Lock()
+    }
+
+def lru_get(cache, key):
+    with cache['lock']:
+        value = cache['items'].get(key)
+        if value is None:
+            cache['stats']['misses'] += 1
+            metrics.count_cache(cache['name'], 'miss')
+            return None
+        cache['items'].move_to_end(key)
+        cache['stats']['hits'] += 1
+        metrics.count_cache(cache['name'], 'hit')
+        return value
+
+def lru_put(cache, key, value):
+    with cache['lock']:
+        items = cache['items']
+        items[key] = value
+        items.move_to_end(key)
+        while len(items) > cache['max_size']:
+            items.popitem(last=False)
+            cache['stats']['evictions'] += 1
+
+def lru_invalidate(cache, is_stale):
+    with cache['lock']:
+        stale_keys = [key for key in cache['items'] if is_stale(key)]
+        for key in stale_keys:
+            del cache['items'][key]
+        cache['stats']['invalidations'] += len(stale_keys)
+
+def lru_stats(cache):
+    with cache['lock']:
+        stats = dict(cache['stats'])
+        stats['size'] = len(cache['items'])
+        stats['max_size'] = cache['max_size']
+        return stats
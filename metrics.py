@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_PREFIX = 'currency_app'
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+histograms = {}
+counters = {}
+metrics_lock = threading.Lock()
+request_timings = threading.local()
+
+def observe(stage, seconds):
+    if not METRICS_ENABLED:
+        return
+    with metrics_lock:
+        histogram = histograms.get(stage)
+        if histogram is None:
+            histogram = {'buckets': [0] * len(HISTOGRAM_BUCKETS), 'sum': 0.0, 'count': 0}
+            histograms[stage] = histogram
+        position = bisect_left(HISTOGRAM_BUCKETS, seconds)
+        if position < len(HISTOGRAM_BUCKETS):
+            histogram['buckets'][position] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+    stages = getattr(request_timings, 'stages', None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+def count_cache(cache, result):
+    if not METRICS_ENABLED:
+        return
+    key = (cache, result)
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + 1
+
+@contextmanager
+def measure(stage):
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+def timed(stage):
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def start_request():
+    request_timings.stages = {}
+    request_timings.started = time.perf_counter()
+
+def run_timed(func, *args):
+    # Для задач в пуле потоков: этапы собираются отдельно и возвращаются
+    # вместе с результатом, чтобы запрос добавил их в свой Server-Timing.
+    request_timings.stages = {}
+    try:
+        result = func(*args)
+        return result, request_timings.stages
+    finally:
+        request_timings.stages = None
+
+def add_stages(stages):
+    current = getattr(request_timings, 'stages', None)
+    if current is None:
+        return
+    for stage, seconds in stages.items():
+        current[stage] = current.get(stage, 0.0) + seconds
+
+def finish_request():
+    stages = getattr(request_timings, 'stages', None)
+    if stages is None:
+        return None
+    total = time.perf_counter() - request_timings.started
+    request_timings.stages = None
+
+    entries = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in stages.items()]
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+def render_metrics(gauges=None, labeled=None):
+    lines = []
+    name = f'{METRICS_PREFIX}_stage_seconds'
+    lines.append(f'# HELP {name} Time spent in each request stage.')
+    lines.append(f'# TYPE {name} histogram')
+    with metrics_lock:
+        snapshot = {stage: dict(h, buckets=list(h['buckets'])) for stage, h in histograms.items()}
+        counter_snapshot = dict(counters)
+
+    for stage, histogram in sorted(snapshot.items()):
+        cumulative = 0
+        for bound, bucket in zip(HISTOGRAM_BUCKETS, histogram['buckets']):
+            cumulative += bucket
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {histogram["sum"]}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {histogram["count"]}')
+
+    name = f'{METRICS_PREFIX}_cache_events_total'
+    lines.append(f'# HELP {name} Cache lookups by cache and result.')
+    lines.append(f'# TYPE {name} counter')
+    for (cache, result), value in sorted(counter_snapshot.items()):
+        lines.append(f'{name}{{cache="{cache}",result="{result}"}} {value}')
+
+    for group, stats in (gauges or {}).items():
+        for key, value in sorted(stats.items()):
+            gauge = f'{METRICS_PREFIX}_{group}_{key}'
+            lines.append(f'# TYPE {gauge} gauge')
+            lines.append(f'{gauge} {value}')
+
+    # labeled: {group: (метка, {значение метки: {key: value}})} — одна метрика
+    # на key вместо отдельного имени для каждого значения метки
+    for group, (label, rows) in (labeled or {}).items():
+        keys = sorted({key for stats in rows.values() for key in stats})
+        for key in keys:
+            gauge = f'{METRICS_PREFIX}_{group}_{key}'
+            lines.append(f'# TYPE {gauge} gauge')
+            for label_value, stats in sorted(rows.items()):
+                if key in stats:
+                    lines.append(f'{gauge}{{{label}="{label_value}"}} {stats[key]}')
+
+    return '\n'.join(lines) + '\n'
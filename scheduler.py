@@ -0,0 +1,31 @@
+import time
+
+LEADER_RETRY_INTERVAL = 60
+
+def run_due_jobs(jobs, next_runs, now):
+    for job in jobs:
+        if now < next_runs.get(job['name'], now):
+            continue
+        try:
+            job['run']()
+        except Exception as e:
+            print(f"[Scheduler] Ошибка задачи {job['name']}: {e}")
+        next_runs[job['name']] = now + job['interval']
+    return min(next_runs.values())
+
+def run_scheduler(jobs, acquire_leadership=None, clock=time.monotonic,
+                  sleep=time.sleep, stop_event=None):
+    next_runs = {}
+    while stop_event is None or not stop_event.is_set():
+        if acquire_leadership is not None and not acquire_leadership():
+            sleep(LEADER_RETRY_INTERVAL)
+            continue
+
+        next_run = run_due_jobs(jobs, next_runs, clock())
+        sleep(max(next_run - clock(), 1))
+
+if __name__ == '__main__':
+    import app
+
+    print("[Scheduler] Запуск фонового обновления курсов")
+    run_scheduler(app.build_refresh_jobs(), app.acquire_refresh_leadership)
@@ -0,0 +1,151 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rates_snapshot.bin'))
+SNAPSHOT_MAGIC = b'CCSNAP01'
+SNAPSHOT_HEADER = struct.Struct('<8sQ')
+
+snapshot_state = {'key': None, 'mmap': None, 'header': None}
+snapshot_lock = threading.Lock()
+
+# Формат файла: магия и длина заголовка, JSON-заголовок с описанием
+# массивов и банковскими курсами, затем выровненный блок float64/int64.
+# Файл только заменяется целиком, поэтому читатели держат mmap без блокировок.
+
+def data_offset(header_length):
+    return (SNAPSHOT_HEADER.size + header_length + 7) // 8 * 8
+
+def open_snapshot(path=SNAPSHOT_PATH):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None, None
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    with snapshot_lock:
+        if snapshot_state['key'] != key:
+            # Старый mmap не закрываем: на него могут ссылаться выданные массивы
+            try:
+                with open(path, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, header_length = SNAPSHOT_HEADER.unpack_from(mm, 0)
+                if magic != SNAPSHOT_MAGIC:
+                    raise ValueError('неизвестный формат')
+                header = json.loads(mm[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + header_length])
+                header['data_offset'] = data_offset(header_length)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"Ошибка чтения снимка курсов: {e}")
+                return None, None
+            snapshot_state.update(key=key, mmap=mm, header=header)
+        return snapshot_state['mmap'], snapshot_state['header']
+
+def array_view(mm, header, descriptor, dtype, limit=None):
+    import numpy as np
+
+    count = descriptor['length'] if limit is None else min(limit, descriptor['length'])
+    return np.frombuffer(mm, dtype=dtype, count=count, offset=header['data_offset'] + descriptor['offset'])
+
+def read_rates(path=SNAPSHOT_PATH):
+    mm, header = open_snapshot(path)
+    if header is None or header['rates'] is None:
+        return None
+    descriptor = header['rates']
+    currencies = descriptor['currencies']
+    return {
+        'currencies': currencies,
+        'index': {currency: i for i, currency in enumerate(currencies)},
+        'usd_rates': array_view(mm, header, descriptor, '<f8'),
+        'timestamp': descriptor['timestamp']
+    }
+
+def read_leg(currency, days, path=SNAPSHOT_PATH):
+    mm, header = open_snapshot(path)
+    if header is None or currency not in header['legs']:
+        return None, None
+    descriptor = header['legs'][currency]
+    rates = array_view(mm, header, descriptor['rates'], '<f8', days)
+    dates = array_view(mm, header, descriptor['dates'], '<i8', days).view('datetime64[D]')
+    return rates, dates
+
+def leg_complete(currency, path=SNAPSHOT_PATH):
+    # Полная нога содержит всю сохранённую историю валюты, а не только хвост
+    _, header = open_snapshot(path)
+    if header is None or currency not in header['legs']:
+        return False
+    return header['legs'][currency].get('complete', False)
+
+def read_banks(currency, path=SNAPSHOT_PATH):
+    _, header = open_snapshot(path)
+    if header is None or currency not in header['banks']:
+        return None, None
+    entry = header['banks'][currency]
+    return entry['rows'], entry['timestamp']
+
+def write_snapshot(rates, legs, banks, path):
+    import numpy as np
+
+    blocks = []
+    position = 0
+
+    def add_array(array, dtype):
+        nonlocal position
+        array = np.ascontiguousarray(array, dtype=dtype)
+        blocks.append(array)
+        descriptor = {'offset': position, 'length': len(array)}
+        position += array.nbytes
+        return descriptor
+
+    header = {'rates': None, 'legs': {}, 'banks': banks}
+    if rates is not None:
+        header['rates'] = dict(add_array(rates['usd_rates'], '<f8'),
+                               currencies=list(rates['currencies']),
+                               timestamp=rates['timestamp'])
+    for currency, (leg_rates, leg_dates, complete) in legs.items():
+        header['legs'][currency] = {
+            'rates': add_array(leg_rates, '<f8'),
+            'dates': add_array(np.asarray(leg_dates, dtype='datetime64[D]').view('<i8'), '<i8'),
+            'complete': complete
+        }
+
+    encoded = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    padding = data_offset(len(encoded)) - SNAPSHOT_HEADER.size - len(encoded)
+
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(encoded)))
+        f.write(encoded)
+        f.write(b'\0' * padding)
+        for array in blocks:
+            f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def update_snapshot(rates=None, legs=None, banks=None, path=SNAPSHOT_PATH):
+    # Обновляем только переданные части; остальное берём из текущего файла.
+    # flock не даёт двум процессам затереть изменения друг друга.
+    try:
+        with open(f'{path}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _, header = open_snapshot(path)
+            current_legs = {}
+            current_banks = {}
+            if header is not None:
+                if rates is None:
+                    rates = read_rates(path)
+                for currency in header['legs']:
+                    current_legs[currency] = read_leg(currency, None, path) + (leg_complete(currency, path),)
+                current_banks = dict(header['banks'])
+
+            current_legs.update(legs or {})
+            now = time.time()
+            for currency, rows in (banks or {}).items():
+                current_banks[currency] = {'rows': rows, 'timestamp': now}
+            write_snapshot(rates, current_legs, current_banks, path)
+    except OSError as e:
+        print(f"Ошибка записи снимка курсов: {e}")
@@ -1 +1,4 @@
-gunicorn app:app
\ No newline at end of file
+# Миграция ждёт MySQL в фоне: приложение поднимается сразу и до появления
+# таблиц отдаёт данные из кэша и снимка курсов.
+flask --app app init-db &
+exec gunicorn -c gunicorn.conf.py app:app
\ No newline at end of file
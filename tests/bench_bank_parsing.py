@@ -0,0 +1,55 @@
+# Замер разбора страниц банков: полный разбор html.parser против find_tables.
+# Страницы — синтетические копии разметки из tests/fixtures.
+# Запуск: python tests/bench_bank_parsing.py [repeats]
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+
+import bank_parsers
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PAGES = [
+    ('bank_kitt_table.html', 'kitt-table', bank_parsers.parse_uralsub),
+    ('bank_rates_table.html', 'rates-table', bank_parsers.parse_vtb),
+]
+
+def full_parse(text, class_name):
+    return BeautifulSoup(text, 'html.parser').find_all('table', class_=class_name)
+
+def measure(func, text, class_name, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        tables = func(text, class_name)
+    elapsed = (time.perf_counter() - started) / repeats
+
+    tracemalloc.start()
+    func(text, class_name)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return tables, elapsed, peak
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print(f"Парсер find_tables: {bank_parsers.get_html_parser()}")
+    for name, class_name, parser in PAGES:
+        with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+            text = f.read()
+
+        # Разметка фикстуры должна разбираться настоящим парсером банка
+        bank_parsers.fetch_source = lambda upstream, url, headers=None: text
+        rates = parser(['USD', 'EUR'])
+        assert set(rates) == {'USD', 'EUR'}, rates
+
+        print(f"{name}: {len(text) / 1024:.0f} КБ")
+        for label, func in (('полный разбор', full_parse), ('find_tables', bank_parsers.find_tables)):
+            tables, elapsed, peak = measure(func, text, class_name, repeats)
+            assert len(tables) == 1
+            print(f"  {label}: {elapsed * 1000:.1f} мс, пик памяти {peak / 1024 / 1024:.1f} МБ")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+# Замер /api/convert/batch на миллионе строк: python tests/bench_batch.py [rows]
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import app
+
+def make_rows(count):
+    currencies = np.array(['USD', 'EUR', 'RUB', 'GBP', 'XXX'])
+    generator = np.random.default_rng(0)
+    amounts = np.round(generator.uniform(1, 1000, count), 2)
+    from_codes = currencies[generator.integers(0, len(currencies), count)]
+    to_codes = currencies[generator.integers(0, len(currencies), count)]
+    return amounts, from_codes, to_codes
+
+def post(client, data, content_type):
+    started = time.perf_counter()
+    response = client.post('/api/convert/batch', data=data, content_type=content_type)
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 200, response.data[:200]
+    return elapsed, len(response.data)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    app.exchange_rates_cache['rates'] = app.make_rate_vector(
+        {'USD': 1.0, 'EUR': 0.92, 'RUB': 95.0, 'GBP': 0.79})
+    app.exchange_rates_cache['timestamp'] = time.time()
+    client = app.app.test_client()
+
+    amounts, from_codes, to_codes = make_rows(count)
+    csv_body = 'amount,from,to\n' + '\n'.join(
+        f'{a},{f},{t}' for a, f, t in zip(amounts.tolist(), from_codes.tolist(), to_codes.tolist()))
+    json_body = json.dumps([[a, f, t] for a, f, t in zip(amounts.tolist(), from_codes.tolist(), to_codes.tolist())])
+
+    for name, body, content_type in (('csv', csv_body, 'text/csv'), ('json', json_body, 'application/json')):
+        elapsed, size = post(client, body, content_type)
+        print(f"{name}: {count} строк за {elapsed:.2f} с, ответ {size / 1e6:.1f} МБ")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+# Замер рендера графика за 7 дней и за 5 лет: python tests/bench_charts.py [repeats]
+import math
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import charts
+
+def make_series(days):
+    dates = [date(2024, 1, 1) - timedelta(days=i) for i in range(days - 1, -1, -1)]
+    rates = [90 + 5 * math.sin(i / 30) + math.sin(i * 1.7) for i in range(days)]
+    return rates, dates
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    # Первый рендер подгружает шрифты matplotlib, его в замер не берём
+    charts.render_exchange_chart('USD', 'RUB', *make_series(7))
+
+    for days, period in ((7, 'за 7 дней'), (1825, 'за 5 лет')):
+        rates, dates = make_series(days)
+        points = len(charts.downsample_series(rates, dates)[0])
+        started = time.perf_counter()
+        for _ in range(repeats):
+            image = charts.render_exchange_chart('USD', 'RUB', rates, dates, period=period)
+        elapsed = (time.perf_counter() - started) / repeats
+        print(f"{period}: {days} дней, {points} точек, {elapsed * 1000:.1f} мс, {len(image) / 1024:.0f} КБ")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+from bs4 import BeautifulSoup
+
+import bank_parsers
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+@pytest.mark.parametrize('name, parser, rates', [
+    ('bank_kitt_table.html', bank_parsers.parse_uralsub, {'USD': (88.15, 91.45), 'EUR': (95.3, 99.05)}),
+    ('bank_rates_table.html', bank_parsers.parse_vtb, {'USD': (88.15, 91.45), 'EUR': (95.3, 99.05)}),
+])
+def test_parsers_read_fixture_pages(monkeypatch, name, parser, rates):
+    text = read_fixture(name)
+    monkeypatch.setattr(bank_parsers, 'fetch_source', lambda upstream, url, headers=None: text)
+    result = parser(['USD', 'EUR'])
+    assert {currency: (row['buy'], row['sell']) for currency, row in result.items()} == rates
+
+def test_strainer_matches_table_with_several_classes(monkeypatch):
+    # Без запасного полного разбора: таблица должна найтись фильтром
+    monkeypatch.setattr(bank_parsers, 'get_html_parser', lambda: 'html.parser')
+    html = '<div><table class="kitt-table kitt-table--rates"><tr><td>USD</td></tr></table></div>'
+    calls = []
+    original = BeautifulSoup.__init__
+
+    def counting_init(self, *args, **kwargs):
+        calls.append(kwargs.get('parse_only'))
+        original(self, *args, **kwargs)
+    monkeypatch.setattr(BeautifulSoup, '__init__', counting_init)
+
+    assert len(bank_parsers.find_tables(html, 'kitt-table')) == 1
+    assert len(calls) == 1 and calls[0] is not None
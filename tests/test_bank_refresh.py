@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+import app
+
+WORKERS = 6
+
+def mysql_available():
+    # Тест очищает bank_rates, поэтому запускается только на тестовой БД
+    if os.getenv('MYSQL_TEST') != '1':
+        return False
+    connection = app.create_connection()
+    if connection is None:
+        return False
+    app.release_connection(connection)
+    return True
+
+def run_worker(scrapes, ttl, start, empty=False):
+    # Каждый процесс — отдельный воркер со своим пулом соединений
+    app.BANK_DB_TTL = ttl
+
+    def counting_refresh(currencies):
+        with scrapes.get_lock():
+            scrapes.value += 1
+        time.sleep(0.5)
+        if empty:
+            return {currency: [] for currency in currencies}
+        return {currency: [{
+            'name': 'Тестовый банк',
+            'buy': 90.0,
+            'sell': 91.0,
+            'updated': '10:00',
+            'currency': currency
+        }] for currency in currencies}
+
+    app.refresh_bank_rates = counting_refresh
+    start.wait()
+    app.refresh_shared_bank_rates()
+
+def run_workers(scrapes, ttl, empty=False):
+    context = multiprocessing.get_context('fork')
+    start = context.Event()
+    processes = [context.Process(target=run_worker, args=(scrapes, ttl, start, empty)) for _ in range(WORKERS)]
+    for process in processes:
+        process.start()
+    start.set()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+def clear_bank_tables():
+    app.init_database()
+    connection = app.create_connection()
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM bank_rates")
+    cursor.execute("DELETE FROM refresh_attempts")
+    connection.commit()
+    cursor.close()
+    app.release_connection(connection)
+
+@pytest.mark.skipif(not mysql_available(), reason='нужна тестовая MySQL (MYSQL_TEST=1)')
+def test_workers_scrape_once_per_ttl():
+    ttl = 3
+    clear_bank_tables()
+
+    scrapes = multiprocessing.get_context('fork').Value('i', 0)
+    run_workers(scrapes, ttl)
+    assert scrapes.value == 1
+
+    run_workers(scrapes, ttl)
+    assert scrapes.value == 1
+
+    time.sleep(ttl + 1)
+    run_workers(scrapes, ttl)
+    assert scrapes.value == 2
+
+@pytest.mark.skipif(not mysql_available(), reason='нужна тестовая MySQL (MYSQL_TEST=1)')
+def test_failed_scrape_is_not_repeated_by_waiters():
+    # Владелец блокировки не получил курсов: ожидающие не парсят банки заново
+    clear_bank_tables()
+    scrapes = multiprocessing.get_context('fork').Value('i', 0)
+    run_workers(scrapes, 60, empty=True)
+    assert scrapes.value == 1
@@ -0,0 +1,60 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import bank_parsers
+
+# Задержка ответа каждого «банка» в секундах
+DELAYS = {'fast': 0.1, 'medium': 0.3, 'slow': 1.0}
+
+class DelayedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(DELAYS[self.path.strip('/')])
+        body = b'USD 90.5 92.5'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def make_parser(base_url, name):
+    def parse(currencies):
+        _, buy, sell = bank_parsers.fetch_source(f'bank_stub_{name}', f'{base_url}/{name}').split()
+        return {'USD': {'buy': float(buy), 'sell': float(sell), 'updated': '-'}}
+    return parse
+
+@pytest.fixture
+def stub_banks(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DelayedHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    monkeypatch.setattr(bank_parsers, 'BANK_PARSERS', [
+        {'name': name, 'parser': make_parser(base_url, name)} for name in DELAYS
+    ])
+    monkeypatch.setattr(bank_parsers, 'last_bank_rates', {})
+    yield
+    server.shutdown()
+    server.server_close()
+
+def timed_refresh():
+    started = time.perf_counter()
+    results = bank_parsers.refresh_bank_rates(['USD'])
+    return time.perf_counter() - started, {row['name'] for row in results['USD']}
+
+def test_refresh_takes_about_slowest_bank(stub_banks):
+    elapsed, names = timed_refresh()
+    assert names == set(DELAYS)
+    # Банки опрашиваются параллельно: время близко к самому медленному, а не к сумме
+    assert max(DELAYS.values()) <= elapsed < max(DELAYS.values()) + 0.3
+    assert elapsed < sum(DELAYS.values())
+
+def test_refresh_honours_deadline(stub_banks, monkeypatch):
+    monkeypatch.setattr(bank_parsers, 'BANKS_DEADLINE', 0.4)
+    elapsed, names = timed_refresh()
+    assert names == {'fast', 'medium'}
+    assert 0.4 <= elapsed < 0.8
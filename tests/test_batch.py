@@ -0,0 +1,48 @@
+import time
+
+import pytest
+
+import app
+
+@pytest.fixture
+def client(monkeypatch):
+    rates = app.make_rate_vector({'USD': 1.0, 'EUR': 0.5, 'RUB': 100.0})
+    monkeypatch.setitem(app.exchange_rates_cache, 'rates', rates)
+    monkeypatch.setitem(app.exchange_rates_cache, 'timestamp', time.time())
+    return app.app.test_client()
+
+def post_json(client, body):
+    return client.post('/api/convert/batch', data=body, content_type='application/json')
+
+def test_batch_converts_object_and_list_rows(client):
+    response = post_json(client, '{"rows": [{"amount": 10, "from": "USD", "to": "EUR"}]}')
+    assert response.status_code == 200
+    assert response.get_json()['results'][0]['converted_amount'] == 5.0
+
+    response = post_json(client, '[[10, "EUR", "RUB"]]')
+    assert response.get_json()['results'][0]['converted_amount'] == 2000.0
+
+@pytest.mark.parametrize('body', [
+    '{bad',
+    '{"a": 1}',
+    '[{"amount": 1, "from": "USD", "to": "EUR"}, [1, "USD", "EUR"]]',
+    '[[1, 2]]',
+])
+def test_batch_rejects_malformed_json(client, body):
+    response = post_json(client, body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_batch_non_string_currency_gives_null_rate(client):
+    response = post_json(client, '[{"amount": 1, "from": ["USD"], "to": "EUR"}, {"amount": 1, "from": 5, "to": "EUR"}]')
+    assert response.status_code == 200
+    assert [row['rate'] for row in response.get_json()['results']] == [None, None]
+
+def test_api_convert_rejects_non_finite_amounts(client):
+    for amount in ('nan', 'inf', '-inf', 'abc', '1e307'):
+        response = client.get(f'/api/convert?from=USD&to=RUB&amount={amount}')
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'Некорректная сумма'}
+
+    response = client.get('/api/convert?from=USD&to=RUB&amount=2')
+    assert response.get_json()['converted_amount'] == 200.0
@@ -0,0 +1,99 @@
+import datetime
+import time
+
+import pytest
+
+import app
+import breakers
+import budget
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Без БД очередь и бюджет живут в памяти процесса
+    fake = FakeClock(1_700_000_000.0)
+    monkeypatch.setattr(app, 'time', fake)
+    monkeypatch.setattr(breakers, 'time', fake)
+    monkeypatch.setattr(app, 'create_connection', lambda: None)
+    monkeypatch.setattr(app, 'REFRESH_MODE', 'inline')
+    monkeypatch.setattr(app, 'api_budget_memory', {})
+    monkeypatch.setattr(app, 'history_queue_memory', {})
+    monkeypatch.setattr(breakers, 'breakers', {})
+    monkeypatch.setattr(app, 'get_latest_historical_date', lambda from_curr, to_curr: None)
+    monkeypatch.setattr(app, 'get_historical_rates_from_db', lambda from_curr, to_curr, days: (None, None))
+    monkeypatch.setattr(app, 'save_historical_rates_to_db', lambda *args: None)
+    monkeypatch.setattr(app, 'update_snapshot_leg', lambda *args, **kwargs: None)
+    return fake
+
+def fake_upstream(monkeypatch, clock, failing=()):
+    calls = []
+
+    class Response:
+        def __init__(self, data):
+            self.data = data
+
+        def json(self):
+            return self.data
+
+    def get(url, params=None, timeout=None):
+        calls.append((clock.now, params['to_symbol']))
+        if params['to_symbol'] in failing:
+            return Response({'Error Message': 'Invalid API call'})
+        day = datetime.date(2024, 1, 2)
+        return Response({'Time Series FX (Daily)': {day.isoformat(): {'4. close': '1.0'}}})
+
+    monkeypatch.setattr(app.requests, 'get', get)
+    return calls
+
+def max_calls_per_minute(calls):
+    times = [moment for moment, _ in calls]
+    return max((sum(1 for t in times if start <= t < start + 60) for start in times), default=0)
+
+def test_burst_for_all_pairs_never_exceeds_quota(monkeypatch, clock):
+    calls = fake_upstream(monkeypatch, clock)
+
+    for from_curr in app.CURRENCIES:
+        for to_curr in app.CURRENCIES:
+            if from_curr != to_curr:
+                app.fetch_historical_range(from_curr, to_curr)
+    for _ in range(2000):
+        clock.advance(15)
+        app.refresh_all_historical_rates()
+
+    assert max_calls_per_minute(calls) <= budget.ALPHA_VANTAGE_PER_MINUTE
+    per_day = {}
+    for moment, _ in calls:
+        day = budget.budget_day(moment)
+        per_day[day] = per_day.get(day, 0) + 1
+    assert max(per_day.values()) <= budget.ALPHA_VANTAGE_PER_DAY
+    assert {currency for _, currency in calls} == set(app.CURRENCIES) - {'USD'}
+
+def test_failing_symbol_does_not_burn_daily_budget(monkeypatch, clock):
+    calls = fake_upstream(monkeypatch, clock, failing={'INR'})
+
+    for _ in range(40):
+        app.fetch_historical_range('USD', 'INR')
+        app.refresh_historical_queue()
+        clock.advance(15)
+
+    assert [currency for _, currency in calls] == ['INR']
+    assert app.api_budget_memory['alpha_vantage']['day_used'] == 1
+    assert 'INR' not in app.history_queue_memory
+
+    app.fetch_historical_range('USD', 'EUR')
+    assert calls[-1][1] == 'EUR'
@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import math
+
+import charts
+
+PAIRS = [('USD', 'EUR'), ('EUR', 'RUB'), ('GBP', 'JPY'), ('CNY', 'USD')]
+
+def make_jobs():
+    jobs = []
+    for n, (from_curr, to_curr) in enumerate(PAIRS):
+        for days, period in ((7, 'за 7 дней'), (1825, 'за 5 лет')):
+            dates = [date(2024, 1, 1) - timedelta(days=i) for i in range(days - 1, -1, -1)]
+            rates = [1 + n + 0.1 * math.sin(i / 5 + n) for i in range(days)]
+            jobs.append({'key': (from_curr, to_curr, period), 'from': from_curr, 'to': to_curr,
+                         'rates': rates, 'dates': dates, 'period': period})
+    return jobs
+
+def test_threaded_render_matches_serial():
+    jobs = make_jobs()
+    serial = [charts.render_chart_job(job) for job in jobs]
+    assert all(image.startswith(b'\x89PNG') for image in serial)
+
+    # Каждое задание несколько раз, чтобы рендеры в потоках пересекались
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        threaded = list(executor.map(charts.render_chart_job, jobs * 3))
+
+    for i, image in enumerate(threaded):
+        assert image == serial[i % len(jobs)], jobs[i % len(jobs)]['key']
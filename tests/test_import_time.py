@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('numpy', 'pandas', 'matplotlib', 'bs4', 'lxml')
+
+def import_times(module='app'):
+    # Разбираем вывод python -X importtime: модуль -> накопленное время, мкс
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+def test_app_import_skips_heavy_modules():
+    times = import_times()
+    loaded = [name for name in times if name.split('.')[0] in HEAVY_MODULES]
+    assert loaded == []
+
+if __name__ == '__main__':
+    times = import_times()
+    print(f"import app: {times['app'] / 1000:.1f} мс")
+    for name, cumulative in sorted(times.items(), key=lambda item: -item[1])[:15]:
+        print(f"{cumulative / 1000:10.1f} мс  {name}")
@@ -0,0 +1,25 @@
+import lru
+
+def test_lru_evicts_least_recently_used():
+    cache = lru.new_lru('test', 2)
+    lru.lru_put(cache, 'a', 1)
+    lru.lru_put(cache, 'b', 2)
+    assert lru.lru_get(cache, 'a') == 1
+    lru.lru_put(cache, 'c', 3)
+
+    assert lru.lru_get(cache, 'b') is None
+    assert lru.lru_get(cache, 'a') == 1
+    assert lru.lru_get(cache, 'c') == 3
+    assert lru.lru_stats(cache) == {'hits': 3, 'misses': 1, 'evictions': 1, 'invalidations': 0,
+                                    'size': 2, 'max_size': 2}
+
+def test_lru_invalidate_by_key():
+    cache = lru.new_lru('test', 10)
+    for key in (('USD', 'EUR'), ('EUR', 'RUB'), ('GBP', 'JPY')):
+        lru.lru_put(cache, key, b'png')
+    lru.lru_invalidate(cache, lambda key: 'EUR' in key)
+
+    assert lru.lru_get(cache, ('GBP', 'JPY')) == b'png'
+    stats = lru.lru_stats(cache)
+    assert stats['size'] == 1
+    assert stats['invalidations'] == 2
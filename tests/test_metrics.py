@@ -0,0 +1,14 @@
+import metrics
+
+def test_labeled_gauges_share_one_metric_name():
+    body = metrics.render_metrics(labeled={'breaker': ('upstream', {
+        'alpha_vantage': {'open': 0, 'failures': 2},
+        'alpha_vantage_USD_EUR': {'open': 1, 'failures': 3},
+    })})
+    lines = body.splitlines()
+
+    assert lines.count('# TYPE currency_app_breaker_open gauge') == 1
+    assert 'currency_app_breaker_open{upstream="alpha_vantage"} 0' in lines
+    assert 'currency_app_breaker_open{upstream="alpha_vantage_USD_EUR"} 1' in lines
+    assert 'currency_app_breaker_failures{upstream="alpha_vantage_USD_EUR"} 3' in lines
+    assert not any(line.startswith('currency_app_breaker_alpha_vantage') for line in lines)
@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+import app
+
+RATES_DELAY = 0.4
+BANKS_DELAY = 0.3
+
+@pytest.fixture
+def slow_sources(monkeypatch):
+    def slow_rates():
+        time.sleep(RATES_DELAY)
+        return app.make_rate_vector({'USD': 1.0, 'EUR': 0.9, 'SGD': 1.3, 'RUB': 95.0})
+
+    def slow_banks(currency):
+        time.sleep(BANKS_DELAY)
+        return [{'name': 'Банк', 'buy': 90.0, 'sell': 92.0, 'updated': '-', 'currency': currency}]
+
+    monkeypatch.setattr(app, 'refresh_exchange_rates', slow_rates)
+    monkeypatch.setattr(app, 'get_bank_rates_from_db', slow_banks)
+    monkeypatch.setattr(app, 'get_cached_page', lambda key: None)
+    monkeypatch.setattr(app, 'exchange_rates_cache', {'rates': None, 'timestamp': 0})
+    monkeypatch.setattr(app, 'bank_rates_memory', {})
+    monkeypatch.setattr(app, 'bank_lookups', {})
+    return app.app.test_client()
+
+def page_time(client):
+    started = time.perf_counter()
+    response = client.get('/')
+    assert response.status_code == 200
+    assert 'Банк' in response.get_data(as_text=True)
+    return time.perf_counter() - started
+
+@pytest.mark.parametrize('fanout', [True, False])
+def test_page_time_with_and_without_fanout(slow_sources, monkeypatch, fanout):
+    monkeypatch.setattr(app, 'PAGE_FANOUT', fanout)
+    elapsed = page_time(slow_sources)
+    if fanout:
+        # Курсы и банки ищутся одновременно: время около максимума задержек
+        assert max(RATES_DELAY, BANKS_DELAY) <= elapsed < RATES_DELAY + BANKS_DELAY - 0.1
+    else:
+        assert elapsed >= RATES_DELAY + BANKS_DELAY
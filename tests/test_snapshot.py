@@ -0,0 +1,65 @@
+from datetime import date, timedelta
+
+import pytest
+
+import app
+import snapshot
+
+@pytest.fixture
+def snapshot_path(tmp_path, monkeypatch):
+    # path — последний аргумент по умолчанию у всех функций снимка
+    path = str(tmp_path / 'rates_snapshot.bin')
+    for func in vars(snapshot).values():
+        defaults = getattr(func, '__defaults__', None)
+        if defaults and defaults[-1] == snapshot.SNAPSHOT_PATH:
+            monkeypatch.setattr(func, '__defaults__', defaults[:-1] + (path,))
+    return path
+
+def make_leg(days, rate=90.0):
+    today = date.today()
+    return [rate + i for i in range(days)], [today - timedelta(days=i + 1) for i in range(days)]
+
+def test_complete_short_leg_served_from_snapshot(snapshot_path, monkeypatch):
+    rates, dates = make_leg(30)
+    snapshot.update_snapshot(legs={'RUB': (rates, dates, True)})
+
+    def no_db(*args):
+        raise AssertionError('полная нога не должна читаться из БД')
+    monkeypatch.setattr(app, 'get_historical_rates_from_db', no_db)
+
+    result_rates, result_dates = app.fetch_historical_range('USD', 'RUB', days=app.HISTORY_MAX_DAYS)
+    assert result_rates == rates
+    assert result_dates == dates
+
+def test_partial_short_leg_falls_back_to_db(snapshot_path, monkeypatch):
+    rates, dates = make_leg(30)
+    snapshot.update_snapshot(legs={'RUB': (rates[:5], dates[:5], False)})
+    calls = []
+
+    def from_db(from_curr, to_curr, days=7):
+        calls.append(days)
+        return rates, dates
+    monkeypatch.setattr(app, 'get_historical_rates_from_db', from_db)
+
+    result_rates, _ = app.fetch_historical_range('USD', 'RUB', days=20)
+    assert calls == [20 + app.HISTORY_ALIGN_MARGIN]
+    assert result_rates == rates[:20]
+
+def test_completeness_survives_other_snapshot_updates(snapshot_path):
+    rates, dates = make_leg(10)
+    snapshot.update_snapshot(legs={'RUB': (rates, dates, True), 'EUR': (rates, dates, False)})
+    snapshot.update_snapshot(banks={'USD': []})
+    assert snapshot.leg_complete('RUB')
+    assert not snapshot.leg_complete('EUR')
+    assert not snapshot.leg_complete('GBP')
+
+def test_update_leg_merges_new_days_into_complete_leg(snapshot_path, monkeypatch):
+    rates, dates = make_leg(10)
+    snapshot.update_snapshot(legs={'RUB': (rates[1:], dates[1:], True)})
+    monkeypatch.setattr(app, 'get_historical_rates_from_db', lambda *args: pytest.fail('лишний запрос в БД'))
+
+    app.update_snapshot_leg('RUB', rates[:2], dates[:2])
+    leg_rates, leg_dates = snapshot.read_leg('RUB', None)
+    assert leg_rates.tolist() == rates
+    assert leg_dates.astype(object).tolist() == dates
+    assert snapshot.leg_complete('RUB')